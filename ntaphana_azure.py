@@ -79,26 +79,87 @@
 #
 # HANA and OS Interface Functions
 #
-import os, sys
-import argparse
+import os, pwd, re, sys
+import concurrent.futures
+import csv
 import datetime, time
+import functools
+import logging
+import shlex
 import subprocess
-from subprocess import check_call, check_output, CalledProcessError
+import threading
+import types
+import weakref
+from subprocess import CalledProcessError
+
+#
+# The SAP HANA client for python is optional, without it we use hdbsql
+# - it is only imported when the first statement is run, so the actions
+#   which don't use HANA don't pay for it
+#
+dbapi = None
+
+@functools.lru_cache(maxsize=None)
+def import_hdbcli():
+    global dbapi
+    try:
+        from hdbcli import dbapi
+    except:
+        dbapi = None
+    return dbapi
 
 #
 # Dynamically detect the platform we're running on by looking for the
 # proper libraries
+# - the libraries are imported once the command line has been parsed, so
+#   --help and argument errors don't pay for importing the Azure SDK
 #
-try:
-    from azure.common.credentials import ServicePrincipalCredentials
-    from azure.mgmt.subscription import SubscriptionClient
-    from azure.mgmt.netapp import AzureNetAppFilesManagementClient
-    from azure.mgmt.resource import ResourceManagementClient
-    from azure.mgmt.netapp.models import Snapshot
-    from azure.mgmt.netapp.models import Volume
-except:
-    print("Error - expected libraries not found, see installation instructions")
-    sys.exit(2)
+def import_libraries():
+    global ServicePrincipalCredentials, SubscriptionClient, \
+        AzureNetAppFilesManagementClient, ResourceManagementClient, \
+        Snapshot, Volume, CloudError, BasicTokenAuthentication, HTTPAdapter
+    try:
+        from azure.common.credentials import ServicePrincipalCredentials
+        from azure.mgmt.subscription import SubscriptionClient
+        from azure.mgmt.netapp import AzureNetAppFilesManagementClient
+        from azure.mgmt.resource import ResourceManagementClient
+        from azure.mgmt.netapp.models import Snapshot
+        from azure.mgmt.netapp.models import Volume
+        from msrestazure.azure_exceptions import CloudError
+        from msrest.authentication import BasicTokenAuthentication
+        from requests.adapters import HTTPAdapter
+    except:
+        print("Error - expected libraries not found, see installation " + \
+            "instructions")
+        sys.exit(2)
+
+#
+# Size the connection pool of the session of a management client
+# - msrest passes the session of the client to this callback before every
+#   request, the adapter is only replaced the first time, keeping the retry
+#   policy msrest gave it
+# - each host gets a connection for every worker thread and for the poller
+#   of every operation those workers start, so batched operations never
+#   wait for a connection or open and discard extra ones
+#
+SIZED_SESSIONS = weakref.WeakSet()
+SIZED_SESSIONS_LOCK = threading.Lock()
+
+def size_session(session, global_config, local_config, **kwargs):
+    with SIZED_SESSIONS_LOCK:
+        if session in SIZED_SESSIONS:
+            return None
+        SIZED_SESSIONS.add(session)
+        adapter = session.get_adapter("https://")
+        session.mount("https://", HTTPAdapter(pool_maxsize=2 * MAX_WORKERS,
+            max_retries=adapter.max_retries))
+    return None
+
+#
+# Execution details are logged at debug level, which is enabled by --verbose;
+# the messages are only formatted when they are actually emitted
+#
+log = logging.getLogger("ntaphana")
 
 #
 # Function for running commands
@@ -107,80 +168,223 @@ except:
 # 
 HANA_NOT_RUNNING = "HANA not running"
 
-def run_command(command, verbose, return_result=False, suppress_error=False, 
+#
+# Return the arguments of subprocess.run to run a command directly as the
+# hdbuser, without su
+# - only possible as root, when the HANA executables are where we expect
+#   them and subprocess can switch users itself (Python 3.9), otherwise None
+#   is returned and the caller falls back to su
+# - the environment is ours with the variables of the hdbuser on top, so
+#   the SAP variables we were started with are kept
+#
+def hdbuser_context(system_id):
+    hdbexe = "/usr/sap/" + system_id.upper() + "/SYS/exe/hdb"
+    if os.geteuid() != 0 or sys.version_info < (3, 9) or \
+        not os.path.isdir(hdbexe):
+        return None
+    user = pwd.getpwnam(system_id.lower() + "adm")
+
+    env = dict(os.environ)
+    env.update({
+        "HOME": user.pw_dir,
+        "USER": user.pw_name,
+        "LOGNAME": user.pw_name,
+        "PATH": hdbexe + ":" + os.environ.get("PATH", "/usr/bin:/bin"),
+        "LD_LIBRARY_PATH": hdbexe,
+    })
+    return {"env": env, "user": user.pw_uid, "group": user.pw_gid,
+        "extra_groups": []}
+
+def run_command(command, return_result=False, suppress_error=False, 
     system_id=False):
-    try:
-        if system_id:
+    context = {}
+    if system_id:
+        # without su, there's no login shell and no profile scripts, the
+        # arguments are passed as they are
+        context = hdbuser_context(system_id) or {}
+        if not context:
+            # su passes the command to a shell, so every argument is quoted
             hdbuser = system_id.lower() + "adm"
             command = ['su', '-', hdbuser, '-c'] + \
-                [" ".join(str(x) for x in command)]
-        if verbose:
-            print("calling: " + " ".join(str(x) for x in command))
-            if return_result:
-                bytestring = check_output(command)
-                output = bytestring.decode('utf-8')
-                print(output)
-                return output
-            else:
-                check_call(command)
-        else:
-            with open(os.devnull, 'w') as DEVNULL:
-                if return_result:
-                    bytestring = check_output(command, stderr=DEVNULL)
-                    output = bytestring.decode('utf-8')
-                    return output
-                else:
-                    check_call(command, stdout=DEVNULL, stderr=DEVNULL)
+                [" ".join(shlex.quote(str(x)) for x in command)]
+    # the output of the commands is shown with --verbose
+    verbose = log.isEnabledFor(logging.DEBUG)
+    if verbose:
+        log.debug("calling: %s", " ".join(str(x) for x in command))
+        output = None
+    else:
+        # DEVNULL is opened once by subprocess rather than on every call
+        output = subprocess.DEVNULL
+    if return_result:
+        output = subprocess.PIPE
+
+    try:
+        # text mode decodes the output, so we never handle bytes
+        result = subprocess.run(command, check=True, text=True, stdout=output,
+            stderr=None if verbose else subprocess.DEVNULL, **context)
     except CalledProcessError as ex:
         if suppress_error:
             return HANA_NOT_RUNNING
         print("Error code: " + str(ex.returncode))
         sys.exit(2)
 
+    if return_result:
+        log.debug("%s", result.stdout)
+        return result.stdout
+
+#
+# Decode the octal escapes (e.g. "\\040" for a space) used by the kernel for
+# the fields of /proc/self/mountinfo
+#
+MOUNT_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+def unescape_mount_field(field):
+    if "\\" not in field:
+        return field
+    return MOUNT_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field)
+
 #
 # Define SQL prefix
+# - no column headers (-a) and no messages (-x), so the output is just rows
+#
+HDBSQL = ('hdbsql', '-a', '-x', '-U')
+
+#
+# SQL statements
+# - the templates are bound str.format methods, filled in by the callers
 #
-HDBSQL = ['hdbsql', '-U']
+GET_DATABASE_STATUSES = "SELECT DATABASE_NAME, ACTIVE_STATUS FROM " + \
+    "SYS.M_DATABASES"
+GET_BACKUP_ID = "SELECT BACKUP_ID FROM M_BACKUP_CATALOG WHERE " + \
+    "ENTRY_TYPE_NAME = 'data snapshot' AND STATE_NAME = 'prepared'"
+OPEN_BACKUP = ("BACKUP DATA FOR FULL SYSTEM CREATE SNAPSHOT " + \
+    "COMMENT '{}'").format
+CLOSE_BACKUP = ("BACKUP DATA FOR FULL SYSTEM CLOSE SNAPSHOT " + \
+    "BACKUP_ID {} {} '{}'").format
 
-def is_hana_running(system_id, userstore_key, verbose):
-    GET_HANA_STATUS = "SELECT ACTIVE_STATUS FROM SYS.M_DATABASES"
+#
+# Run a SQL statement and return the rows of the result as tuples of strings
+#
+# If the SAP HANA client for python (hdbcli) is installed, one connection is
+# opened with the userstore key and kept for the rest of the command, rather
+# than starting su and hdbsql for every statement. Otherwise, or if the
+# connection can't be opened, the statement is run with hdbsql.
+#
+# Returns None if the statement failed and suppress_error is set. If
+# first_only is set, only the first row is fetched and parsed.
+#
+HDB_CONNECTIONS = {}
+
+def get_hdb_connection(system_id, userstore_key):
+    key = (system_id, userstore_key)
+    if key in HDB_CONNECTIONS:
+        return HDB_CONNECTIONS[key]
+    # $HOME is shared by all threads, so it's only changed while no other
+    # thread is running, otherwise the statement is run with hdbsql
+    if threading.active_count() > 1:
+        return None
+
+    connection = None
+    if system_id and import_hdbcli():
+        # the userstore belongs to the hdbuser and is found through $HOME
+        home = os.environ.get("HOME")
+        try:
+            os.environ["HOME"] = \
+                pwd.getpwnam(system_id.lower() + "adm").pw_dir
+            connection = dbapi.connect(key=userstore_key)
+        except Exception as ex:
+            log.debug("hdbcli connection failed, using hdbsql: %s", ex)
+        finally:
+            if home is None:
+                del os.environ["HOME"]
+            else:
+                os.environ["HOME"] = home
+    HDB_CONNECTIONS[key] = connection
+    return connection
+
+def run_sql(sql, system_id, userstore_key, suppress_error=False,
+    first_only=False):
+    connection = get_hdb_connection(system_id, userstore_key)
+    if connection:
+        log.debug("executing: %s", sql)
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(sql)
+                if not cursor.description:
+                    return []
+                if first_only:
+                    row = cursor.fetchone()
+                    rows = [row] if row else []
+                else:
+                    rows = cursor.fetchall()
+                rows = [tuple(str(value) for value in row) for row in rows]
+            finally:
+                cursor.close()
+        except dbapi.Error as ex:
+            if suppress_error:
+                return None
+            print("Error - " + str(ex))
+            sys.exit(2)
+        log.debug("%s", rows)
+        return rows
 
-    output = run_command(HDBSQL + [userstore_key] + [GET_HANA_STATUS],
-        verbose, True, True, system_id=system_id)
+    output = run_command((*HDBSQL, userstore_key, sql),
+        return_result=True, suppress_error=suppress_error, system_id=system_id)
     if output == HANA_NOT_RUNNING:
+        return None
+    if first_only:
+        output = output.partition("\n")[0]
+    return [tuple(row) for row in csv.reader(output.splitlines()) if row]
+
+#
+# Look up the state of every database in one query
+# - returns a dictionary of database names and their ACTIVE_STATUS, in the
+#   order returned by HANA (the system database first), or an empty
+#   dictionary if HANA is not running
+#
+def get_database_statuses(system_id, userstore_key):
+    rows = run_sql(GET_DATABASE_STATUSES, system_id, userstore_key,
+        suppress_error=True)
+    if rows is None:
+        return {}
+    return dict(rows)
+
+def is_hana_running(system_id, userstore_key, statuses=None):
+    if statuses is None:
+        statuses = get_database_statuses(system_id, userstore_key)
+    if not statuses:
         return False
-    output = output.split()[1]
-    if output == '"YES"':
+    output = next(iter(statuses.values()))
+    if output == "YES":
         return True
     print("Error - database in unexpected state: " + output)
     sys.exit(2)
 
-def is_tenant_running(system_id, userstore_key, verbose):
-    GET_TENANT_STATUS = "SELECT ACTIVE_STATUS FROM SYS.M_DATABASES WHERE " + \
-        "DATABASE_NAME = \"'" + system_id + "'\""
-
-    output = run_command(HDBSQL + [userstore_key] + [GET_TENANT_STATUS], 
-        verbose, True, True, system_id=system_id)
-    if output == HANA_NOT_RUNNING:
+def is_tenant_running(system_id, userstore_key, statuses=None):
+    if statuses is None:
+        statuses = get_database_statuses(system_id, userstore_key)
+    if not statuses:
         return False
-    output = output.split()[1]
-    if output == '"YES"':
+    output = statuses.get(system_id, "NO")
+    if output == "YES":
         return True
-    elif output == '"NO"':
+    elif output == "NO":
         return False
     print("Error - tenant database in unexpected state: " + output)
     sys.exit(2)
 
 #
 # To close an open backup, we first need to have the backup id
+# - the id is remembered per SID when the backup is opened, so closing a
+#   backup opened by this process doesn't query it again
 #
-def get_backup_id(system_id, userstore_key, verbose):
-    GET_BACKUP_ID = "SELECT BACKUP_ID FROM M_BACKUP_CATALOG WHERE " + \
-        "ENTRY_TYPE_NAME = \"'data snapshot'\" AND STATE_NAME = \"'prepared'\""
+BACKUP_IDS = {}
 
-    output = run_command(HDBSQL + [userstore_key] + [GET_BACKUP_ID], verbose, 
-        return_result=True, system_id=system_id)
-    backup_id = output.split()[1]
+def get_backup_id(system_id, userstore_key):
+    rows = run_sql(GET_BACKUP_ID, system_id, userstore_key,
+        first_only=True)
+    backup_id = rows[0][0] if rows else "0"
     if int(backup_id) == 0:
         print("Error: failed to find open snapshot")
         sys.exit(2)
@@ -190,28 +394,27 @@ def get_backup_id(system_id, userstore_key, verbose):
 # Open a HANA backup
 #
 # We use this helper function so it can be called by other functions
+# - callers name the backup, so the same name can be used for the snapshots
 #
-def open_backup_internal(ebid, system_id, userstore_key, verbose):
-    OPEN_BACKUP = "BACKUP DATA FOR FULL SYSTEM CREATE SNAPSHOT COMMENT"
+def open_backup_internal(ebid, system_id, userstore_key):
+    run_sql(OPEN_BACKUP(ebid), system_id, userstore_key)
 
-    if ebid:
-        comment = "'" + ebid + "'"
-    else:
-        comment = "'" + create_snapshot_name() + "'"
-    output = run_command(HDBSQL + [userstore_key] + [OPEN_BACKUP + " \"" + \
-        comment + "\""], verbose, system_id=system_id)
+    backup_id = get_backup_id(system_id, userstore_key)
+    BACKUP_IDS[system_id] = backup_id
+    return backup_id
 
 #
 # This is the entry point for the command line option
 #
-def open_backup(ebid, system_id, userstore_key, verbose):
+def open_backup(ebid, system_id, userstore_key):
     if not system_id:
         print("Error - no SID specified, specify with " + \
                 "--SID or in configuration file")
         sys.exit(2)
+    if not ebid:
+        ebid = create_snapshot_name()
 
-    open_backup_internal(ebid, system_id, userstore_key, verbose)
-    backup_id = get_backup_id(system_id, userstore_key, verbose)
+    backup_id = open_backup_internal(ebid, system_id, userstore_key)
     print("Opened backup: " + backup_id)
 
 #
@@ -219,41 +422,40 @@ def open_backup(ebid, system_id, userstore_key, verbose):
 #
 # We use this helper function so it can be called by other functions
 #
-def close_backup_internal(ebid, system_id, userstore_key, successful, verbose):
-    CLOSE_BACKUP = "BACKUP DATA FOR FULL SYSTEM CLOSE SNAPSHOT BACKUP_ID"
-
-    backup_id = get_backup_id(system_id, userstore_key, verbose)
+def close_backup_internal(ebid, system_id, userstore_key, successful):
+    backup_id = BACKUP_IDS.pop(system_id, None)
+    if not backup_id:
+        backup_id = get_backup_id(system_id, userstore_key)
     if successful:
-        if ebid:
-            comment = "\"'" + ebid + "'\""
-        else:
-            comment = "\"'NetApp snapshot successful'\""
-        run_command(HDBSQL + [userstore_key] + [CLOSE_BACKUP] + [backup_id] + \
-            ["SUCCESSFUL"] + [comment], verbose, system_id=system_id)
+        comment = ebid or "NetApp snapshot successful"
+        run_sql(CLOSE_BACKUP(backup_id, "SUCCESSFUL", comment),
+            system_id, userstore_key)
     else:
-        comment = "\"'NetApp snapshot creation timed out'\""
-        run_command(HDBSQL + [userstore_key] + [CLOSE_BACKUP] + [backup_id] + \
-            ["UNSUCCESSFUL"] + [comment], verbose, system_id=system_id)
+        comment = "NetApp snapshot creation timed out"
+        run_sql(CLOSE_BACKUP(backup_id, "UNSUCCESSFUL", comment),
+            system_id, userstore_key)
     return backup_id
 
 #
 # This is the entry point for the command line option
 #
-def close_backup(ebid, system_id, userstore_key, verbose):
+def close_backup(ebid, system_id, userstore_key):
     if not system_id:
         print("Error - no SID specified, specify with " + \
                 "--SID or in configuration file")
         sys.exit(2)
 
-    backup_id = close_backup_internal(ebid, system_id, userstore_key, True, \
-        verbose)
+    backup_id = close_backup_internal(ebid, system_id, userstore_key, True)
     print("Closed backup: " + backup_id)
 
 #
 # This helper function handles the OS-related restore steps
+# - this is the fallback used when the volume can't be reverted in place;
+#   --inplace and --no-whole-file only rewrite the blocks which changed
+#   since the snapshot was taken
 #
-def restore_internal(mount_point, snapshot, verbose):
-    RSYNC = ["rsync", "-axhv", "--delete", "--progress"]
+def restore_internal(mount_point, snapshot):
+    RSYNC = ["rsync", "-ax", "--delete", "--inplace", "--no-whole-file"]
 
     if not mount_point:
         print("Error - volume '" + cloud_volume + "' not found: " +
@@ -268,24 +470,99 @@ def restore_internal(mount_point, snapshot, verbose):
         print("Error - snapshot '" + snapshot + "' not found")
         sys.exit(2)
 
-    run_command(RSYNC + [source] + [destination], verbose)
+    if log.isEnabledFor(logging.DEBUG):
+        # a single progress line rather than a line per file
+        run_command(RSYNC + ["--info=progress2"] + [source] + [destination])
+    else:
+        run_command(RSYNC + [source] + [destination])
     print("Restore complete")
 
 #
 # Generate a default snapshot name
 #
+SNAPSHOT_NAME_TABLE = str.maketrans(":.", "--")
+
 def create_snapshot_name():
-    # snapshot names may not contain ":" or "." characters, so remove
+    # snapshot names may not contain ":" or "." characters, so replace them
+    # in a single pass
     date = datetime.datetime.now().isoformat()
-    snapshot_name = date.replace(":","-").replace(".","-")
-    return snapshot_name
+    return date.translate(SNAPSHOT_NAME_TABLE)
 
 import json
 
+#
+# orjson is optional, with it the key, configuration and cache files are
+# parsed faster
+#
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 DEFAULT_SERVICE_ACCOUNT_FILE_NAME = 'key.json'
 DEFAULT_CONFIG_FILE_NAME = 'config.json'
 DEFAULT_USERSTORE_KEY = 'SYSTEM'
 DEFAULT_TIMEOUT = 5
+# the most Azure requests we make in parallel
+MAX_WORKERS = 8
+
+#
+# Credentials cache
+# - the access token and subscription id of each key file are kept on disk
+#   between runs, so scripted invocations don't authenticate every time
+# - entries are dropped when the key file changes, and tokens are only used
+#   until shortly before they expire
+# - the file is only readable by its owner, as it contains access tokens
+#
+CREDENTIALS_CACHE = os.path.join(os.path.expanduser("~"), ".cache",
+    "ntaphana", "credentials.json")
+TOKEN_EXPIRY_MARGIN = 60
+
+def load_cache(path):
+    try:
+        with open(path) as file:
+            return json_loads(file.read())
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(path, cache):
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # write a new file and rename it, so readers never see a partial file
+        temp_path = path + "." + str(os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            json.dump(cache, file)
+        os.replace(temp_path, path)
+    except OSError as ex:
+        log.debug("Failed to save cache '%s': %s", path, ex)
+
+#
+# Resource Manager type of ANF volumes, and a filter which only returns them
+#
+VOLUME_TYPE = "Microsoft.NetApp/netAppAccounts/capacityPools/volumes"
+VOLUME_FILTER = "resourceType eq '" + VOLUME_TYPE + "'"
+
+#
+# Return the cloud volumes as a tuple, they are given as a comma-separated
+# string on the command line and as a list in the configuration file
+#
+def split_cloud_volumes(cloud_volumes):
+    if not cloud_volumes:
+        return ()
+    if isinstance(cloud_volumes, str):
+        cloud_volumes = cloud_volumes.split(",")
+    return tuple(volume.strip() for volume in cloud_volumes if volume.strip())
+
+#
+# Split an ANF resource id into its resource group, netapp account and
+# capacity pool
+# - the same volume is parsed many times per command, so remember the result
+#
+@functools.lru_cache(maxsize=64)
+def parse_resource_id(resource_id):
+    path = resource_id.split('/')
+    return path[4], path[8], path[10]
 
 #
 # Azure API Integration
@@ -295,17 +572,134 @@ DEFAULT_TIMEOUT = 5
 
 class ANF():
 
+    def __init__(self):
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self.volume_cache = {}
+        # credentials, subscription ids and configuration files are loaded
+        # once and reused by every call in the same process
+        self.auth_cache = {}
+        self.subscription_cache = {}
+        self.config_cache = {}
+        self.credentials_cache = None
+        self.mounts = None
+        self.exports = None
+
+    #
+    # Read the filesystems mounted on this host
+    # - /proc/self/mountinfo is parsed once per process, rather than calling
+    #   findmnt or scanning /proc/mounts for every volume
+    # - mounts maps each mount point to its source, exports maps the export
+    #   of each NFS source to the first mount point it was found on
+    #
+    def get_mounts(self):
+        if self.mounts is not None:
+            return self.mounts
+
+        mounts = {}
+        exports = {}
+        with open('/proc/self/mountinfo', 'r') as file:
+            for line in file:
+                fields = line.split()
+                # the optional fields end with a "-", which is followed by
+                # the filesystem type and the source
+                separator = fields.index("-", 6)
+                mount_point = unescape_mount_field(fields[4])
+                source = unescape_mount_field(fields[separator + 2])
+                mounts[mount_point] = source
+                path = source.split("/")
+                if len(path) == 2:
+                    exports.setdefault(path[1], mount_point)
+
+        # only publish complete maps, other threads may be reading them
+        self.exports = exports
+        self.mounts = mounts
+        return self.mounts
+
+    #
+    # Return the source of the filesystem mounted on cloud_volume, or an empty
+    # string if cloud_volume is not a mount point
+    #
+    def get_source(self, cloud_volume):
+        if cloud_volume.startswith("/"):
+            cloud_volume = os.path.realpath(cloud_volume)
+        return self.get_mounts().get(cloud_volume, "")
+
+    #
+    # Return a management client for the credentials and subscription
+    # - clients are created once and reused, keeping their connections open
+    #   between calls
+    #
+    def get_client(self, client_class, credentials, subscription_id=None):
+        key = (client_class, subscription_id, credentials)
+        # the clients are shared by the threads looking up volumes
+        with self.clients_lock:
+            client = self.clients.get(key)
+            if client:
+                return client
+
+            if subscription_id:
+                client = client_class(credentials, subscription_id)
+            else:
+                client = client_class(credentials)
+            # entering the client sets keep_alive, so msrest keeps one
+            # session for all of the requests of the client rather than
+            # opening one for every request
+            client.config.session_configuration_callback = size_session
+            client.__enter__()
+            self.clients[key] = client
+            return client
+
+    #
+    # Close the connections of all of the clients we created, each client
+    # closes its own session
+    #
+    def close(self):
+        for client in self.clients.values():
+            client.close()
+        self.clients = {}
+
+    #
+    # Return the entry of the key file in the credentials cache
+    # - the entry is reset if the key file was modified since it was cached
+    #
+    def get_cache_entry(self, key_file):
+        if self.credentials_cache is None:
+            self.credentials_cache = load_cache(CREDENTIALS_CACHE)
+        try:
+            mtime_ns = os.stat(key_file).st_mtime_ns
+        except OSError:
+            return {}
+        path = os.path.abspath(key_file)
+        entry = self.credentials_cache.get(path)
+        if not entry or entry.get("mtime_ns") != mtime_ns:
+            entry = {"mtime_ns": mtime_ns}
+            self.credentials_cache[path] = entry
+        return entry
+
     #
     # Get the credentials from the key file and construct the
     # ServicePrincipalCredentials
+    # - a cached access token is used instead while it is valid
     #
-    def get_auth(self, key_file, verbose):
+    def get_auth(self, key_file):
         if not key_file:
             key_file = DEFAULT_SERVICE_ACCOUNT_FILE_NAME
+        if key_file in self.auth_cache:
+            return self.auth_cache[key_file]
+
+        entry = self.get_cache_entry(key_file)
+        token = entry.get("token")
+        if token and float(token["expires_on"]) - TOKEN_EXPIRY_MARGIN > \
+            time.time():
+            log.debug("Using the cached access token for '%s'", key_file)
+            credentials = BasicTokenAuthentication(token)
+            self.auth_cache[key_file] = credentials
+            return credentials
 
         try:
             with open(key_file) as file:
-                service_principal = json.load(file)
+                service_principal = json_loads(file.read())
         except:
             print("File '" + key_file + "' not found or failed to load")
             return ""
@@ -316,32 +710,66 @@ class ANF():
             tenant = service_principal.get("tenant")
         )
 
+        token = credentials.token
+        if entry and "expires_on" in token:
+            entry["token"] = {
+                "access_token": token["access_token"],
+                "token_type": token.get("token_type", "Bearer"),
+                "expires_on": token["expires_on"],
+            }
+            save_cache(CREDENTIALS_CACHE, self.credentials_cache)
+
+        self.auth_cache[key_file] = credentials
         return credentials
 
     #
     # Lookup the subscription id
     # - if there are more than one, warn the user and use the first
     #
-    def get_subscription_id(self, key_file, verbose):
-        credentials = self.get_auth(key_file, verbose)
+    def get_subscription_id(self, key_file):
+        if not key_file:
+            key_file = DEFAULT_SERVICE_ACCOUNT_FILE_NAME
+        if key_file in self.subscription_cache:
+            return self.subscription_cache[key_file]
+        entry = self.get_cache_entry(key_file)
+        if entry.get("subscription_id"):
+            self.subscription_cache[key_file] = entry["subscription_id"]
+            return entry["subscription_id"]
+        credentials = self.get_auth(key_file)
         subscription_id = ""
-        
-        subscription_client = SubscriptionClient(credentials)
+
+        subscription_client = self.get_client(SubscriptionClient, credentials)
         for item in subscription_client.subscriptions.list():
             if not subscription_id:
                 subscription_id = item.subscription_id
-            elif verbose:
-                print("You have more than one subscription id, " + \
+            else:
+                log.debug("You have more than one subscription id, " + \
                     "using the first one returned; consider setting " + \
                     "subscription_id in configuration file")
 
+        if entry and subscription_id:
+            entry["subscription_id"] = subscription_id
+            save_cache(CREDENTIALS_CACHE, self.credentials_cache)
+        self.subscription_cache[key_file] = subscription_id
         return subscription_id
 
     #
     # Read parameters out of the config file
     #
     def get_config(self, config_file, key_file, system_id, userstore_key,
-        cloud_volumes, verbose):
+        cloud_volumes, subscription_id=None, required=()):
+        # the file isn't read if the command line has all of the values
+        # required by the action
+        values = {"subscription_id": subscription_id, "SID": system_id,
+            "userstore_key": userstore_key, "cloud_volumes": cloud_volumes}
+        # the subscription is only looked up with the credentials if the
+        # action needs it
+        lookup_subscription = not required or "subscription_id" in required
+        if required and all(values[key] for key in required):
+            log.debug("Configuration complete, not loading a file")
+            return subscription_id, system_id, userstore_key, \
+                split_cloud_volumes(cloud_volumes), ""
+
         # command line argument takes precedence over file name based on SID
         # which takes precedence over the default file name
         if not config_file:
@@ -350,25 +778,27 @@ class ANF():
             else:
                 config_file = DEFAULT_CONFIG_FILE_NAME
 
-        if verbose:
-            print("Loading configuration from '" + config_file + "'")
+        log.debug("Loading configuration from '%s'", config_file)
 
         try:
-            with open(config_file) as file:
-                config = json.load(file)
+            config = self.config_cache.get(config_file)
+            if config is None:
+                with open(config_file) as file:
+                    config = json_loads(file.read())
+                self.config_cache[config_file] = config
         except:
-            if verbose:
-                print("File '" + config_file + "' not found or failed to load")
-            subscription_id = self.get_subscription_id(key_file, verbose)
+            log.debug("File '%s' not found or failed to load", config_file)
+            if not subscription_id and lookup_subscription:
+                subscription_id = self.get_subscription_id(key_file)
             if not userstore_key:
                 userstore_key = DEFAULT_USERSTORE_KEY
-            if cloud_volumes:
-                cloud_volumes = cloud_volumes.split(",")
-            return subscription_id, system_id, userstore_key, cloud_volumes, ""
+            return subscription_id, system_id, userstore_key, \
+                split_cloud_volumes(cloud_volumes), ""
 
-        subscription_id = config.get("subscription_id")
         if not subscription_id:
-            subscription_id = self.get_subscription_id(key_file, verbose)
+            subscription_id = config.get("subscription_id")
+        if not subscription_id and lookup_subscription:
+            subscription_id = self.get_subscription_id(key_file)
         if not system_id:
             system_id = config.get("SID")
         if not userstore_key:
@@ -377,64 +807,59 @@ class ANF():
                 userstore_key = DEFAULT_USERSTORE_KEY
         if not cloud_volumes:
             cloud_volumes = config.get("cloud_volumes")
-        else:
-            cloud_volumes = cloud_volumes.split(",")
+        cloud_volumes = split_cloud_volumes(cloud_volumes)
 
         return subscription_id, system_id, userstore_key, cloud_volumes, ""
 
     #
     # examine an untyped member of a resource group and return true if it is a
-    # volume
+    # volume whose id ends with suffix ("/volumes/" followed by the name)
     #
-    def is_volume(self, member, volume_name):
+    def is_volume(self, member, suffix):
         # a volume id has the following format:
         # /subscriptions/a6789047-29d4-4ce0-89e6-dfbbe5ad95e0/resourceGroups/
         # techmarketing.rg/providers/Microsoft.NetApp/netAppAccounts/
         # techmarketing/capacityPools/tmpool01/volumes/myVolumeName
-        path = member.id.split('/')
-
-        if (len(path) == 13) and (path[11] == 'volumes') and \
-            (path[12] == volume_name):
-            return True
-
-        return False
+        # comparing the end of the string avoids splitting every id
+        return member.type == VOLUME_TYPE and member.id.endswith(suffix)
 
     #
     # cloud_volume could be a path to a mount point or the name of a
     # cloud volume, in either case, the volume's attributes are returned
     #
-    def get_volume(self, cloud_volume, subscription_id, credentials, verbose):
-        cloud_volume_candidate = run_command(["/bin/findmnt", cloud_volume,
-            "-no", "SOURCE"], False, return_result=True, suppress_error=True)
-        if cloud_volume_candidate != HANA_NOT_RUNNING:
-            volume_name = (cloud_volume_candidate.split("/")[1]).strip("\n")
+    def get_volume(self, cloud_volume, subscription_id, credentials):
+        source = self.get_source(cloud_volume)
+        if source:
+            volume_name = source.split("/")[1]
         else:
             volume_name = cloud_volume
+        volume = self.volume_cache.get((subscription_id, volume_name))
+        if volume:
+            return volume
         generic_volume = ""
 
-        resource_client = ResourceManagementClient(credentials, subscription_id)
-
-        # we iterate through every member of every resource group the user has
-        # access to and look for a matching volume
-        for item in resource_client.resource_groups.list():
-            for member in resource_client.resources.list_by_resource_group(
-                item.name):
-                if self.is_volume(member, volume_name):
-                    if generic_volume:
-                        print("Error - Found more than one volume named '" + \
-                            cloud_volume + "'")
-                        sys.exit(2)
-                    generic_volume = member
-                    resource_group, netapp_account, capacity_pool = \
-                        self.parse_volume_id(generic_volume)
-                    if verbose:
-                        print("Found volume '" + member.name + "'")
+        resource_client = self.get_client(ResourceManagementClient, credentials,
+            subscription_id)
+
+        # rather than walking every member of every resource group the user
+        # has access to, we ask for the volumes only and look for a match
+        suffix = "/volumes/" + volume_name
+        for member in resource_client.resources.list(filter=VOLUME_FILTER):
+            if self.is_volume(member, suffix):
+                if generic_volume:
+                    print("Error - Found more than one volume named '" + \
+                        cloud_volume + "'")
+                    sys.exit(2)
+                generic_volume = member
+                resource_group, netapp_account, capacity_pool = \
+                    self.parse_volume_id(generic_volume)
+                log.debug("Found volume '%s'", member.name)
 
         if not generic_volume:
             return ""
 
-        anf_client = AzureNetAppFilesManagementClient(credentials,
-            subscription_id)
+        anf_client = self.get_client(AzureNetAppFilesManagementClient,
+            credentials, subscription_id)
         volume = anf_client.volumes.get(resource_group, netapp_account,
             capacity_pool, volume_name)
 
@@ -442,6 +867,7 @@ class ANF():
             print("Volume '" + cloud_volume + "' not found")
             sys.exit(2)
 
+        self.volume_cache[(subscription_id, volume_name)] = volume
         return volume
 
     #
@@ -451,16 +877,15 @@ class ANF():
     # - capacity pool
     #
     def parse_volume_id(self, volume):
-        path = volume.id.split('/')
-        return path[4], path[8], path[10]
+        return parse_resource_id(volume.id)
 
     #
     # Lookup the id for a snapshot
     #
     def get_snapshot_id(self, subscription_id, credentials, volume, 
-        snapshot_name, verbose):
-        anf_client = AzureNetAppFilesManagementClient(credentials,
-            subscription_id)
+        snapshot_name):
+        anf_client = self.get_client(AzureNetAppFilesManagementClient,
+            credentials, subscription_id)
 
         resource_group, netapp_account, capacity_pool =  \
             self.parse_volume_id(volume)
@@ -473,22 +898,54 @@ class ANF():
         except:
             return ""
 
+    #
+    # List all of the snapshots of a volume
+    #
+    def get_snapshots(self, subscription_id, credentials, volume):
+        anf_client = self.get_client(AzureNetAppFilesManagementClient,
+            credentials, subscription_id)
+
+        resource_group, netapp_account, capacity_pool =  \
+            self.parse_volume_id(volume)
+        cloud_volume = volume.creation_token
+
+        return list(anf_client.snapshots.list(resource_group, netapp_account,
+            capacity_pool, cloud_volume))
+
+    #
+    # Look up a cloud volume and the names of its snapshots
+    # - the snapshots are listed once and searched locally, rather than
+    #   probing for a snapshot by name
+    #
+    def lookup_cloud_volume(self, cloud_volume, subscription_id, credentials):
+        vol = self.get_volume(cloud_volume, subscription_id, credentials)
+        if not vol:
+            return vol, set()
+        snapshot_names = set(snapshot.name.split("/")[-1] for snapshot in
+            self.get_snapshots(subscription_id, credentials, vol))
+        return vol, snapshot_names
+
     #
     # Go through a list of volumes to make sure they all exist and none
     # have a snapshot of the given name
+    # - the volumes are independent, so they are looked up in parallel and
+    #   then checked in order
     #
     def validate_cloud_volumes(self, cloud_volumes, subscription_id, 
-        credentials, snapshot_name, verbose):
+        credentials, snapshot_name):
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(MAX_WORKERS, len(cloud_volumes))) as executor:
+            futures = [executor.submit(self.lookup_cloud_volume, cloud_volume,
+                subscription_id, credentials)
+                for cloud_volume in cloud_volumes]
+            results = [future.result() for future in futures]
+
         volumes = {}
-        for cloud_volume in cloud_volumes:
-            vol = self.get_volume(cloud_volume, subscription_id, credentials, 
-                verbose)
+        for cloud_volume, (vol, snapshot_names) in zip(cloud_volumes, results):
             if not vol:
                 print("Error - volume '" + cloud_volume + "' not found")
                 sys.exit(2)
-            snapshot_id = self.get_snapshot_id(subscription_id, credentials,
-                vol, snapshot_name, verbose)
-            if snapshot_id:
+            if snapshot_name in snapshot_names:
                 print("Error - snapshot '" + snapshot_name + "' already exists")
                 sys.exit(2)
             volumes.update([(cloud_volume, vol)])
@@ -500,33 +957,41 @@ class ANF():
     # - assumes the cloud volume list has already been validated
     #
     def create_snapshot_internal(self, volumes, cloud_volumes, subscription_id,
-        credentials, snapshot_name, verbose):
-        anf_client = AzureNetAppFilesManagementClient(credentials,
-            subscription_id)
-
-        start_time = datetime.datetime.now()
+        credentials, snapshot_name):
+        anf_client = self.get_client(AzureNetAppFilesManagementClient,
+            credentials, subscription_id)
+
+        start_time = time.perf_counter()
+        # start every snapshot before waiting on any of them, the pollers
+        # track the long running operations in the background so the
+        # snapshots are taken in parallel
+        # - at most MAX_WORKERS snapshots are in progress at the same time
+        pollers = []
         for cloud_volume in cloud_volumes:
+            if len(pollers) >= MAX_WORKERS:
+                pollers.pop(0).result()
             volume = volumes[cloud_volume]
             resource_group, netapp_account, capacity_pool = \
                 self.parse_volume_id(volume)
             volume_name = volume.creation_token
             snapshot_body = Snapshot(location=volume.location,
                 file_system_id=volume.file_system_id)
-            # this is a blocking call, so no need to wait for a response
-            anf_client.snapshots.create(snapshot_body, resource_group, 
-                netapp_account, capacity_pool, volume_name, 
-                snapshot_name).result()
-        elapsed = datetime.datetime.now() - start_time
+            pollers.append(anf_client.snapshots.create(snapshot_body,
+                resource_group, netapp_account, capacity_pool, volume_name,
+                snapshot_name))
+        for poller in pollers:
+            poller.result()
+        elapsed = time.perf_counter() - start_time
 
         print("Created snapshot '" + snapshot_name + "' in " + \
-            str(elapsed.total_seconds()) + " seconds")
+            str(round(elapsed, 6)) + " seconds")
         return True
 
     #
     # Create a snapshot of each cloud volume in the list
     #
     def create_snapshot(self, cloud_volumes, snapshot_name, system_id,
-        credentials, client_id, verbose):
+        credentials, client_id):
         subscription_id = client_id
 
         # validate arguments
@@ -540,20 +1005,19 @@ class ANF():
             print("Error - no cloud volumes specified, specify with " + \
                 "--cloud-volumes or in configuration file")
             sys.exit(2)
-        if verbose:
-            print("Preparing to create snapshot of: " + \
-                ", ".join(cloud_volumes))
+        log.debug("Preparing to create snapshot of: %s",
+            ", ".join(cloud_volumes))
         volumes = self.validate_cloud_volumes(cloud_volumes, subscription_id,
-            credentials, snapshot_name, verbose)
+            credentials, snapshot_name)
 
         self.create_snapshot_internal(volumes, cloud_volumes, subscription_id,
-            credentials, snapshot_name, verbose)
+            credentials, snapshot_name)
 
     #
     # Create an application-consistent snapshot of a HANA database
     #
     def hana_backup(self, cloud_volumes, snapshot_name, system_id,
-        userstore_key, auth, client_id, verbose):
+        userstore_key, auth, client_id):
         credentials = auth
         subscription_id = client_id
 
@@ -568,37 +1032,33 @@ class ANF():
             print("Error - no cloud volumes specified, specify with " + \
                 "--cloud-volumes or in configuration file")
             sys.exit(2)
-        if verbose:
-            print("Preparing to create snapshot of: " + \
-                ", ".join(cloud_volumes))
+        log.debug("Preparing to create snapshot of: %s",
+            ", ".join(cloud_volumes))
         if not system_id:
             print("Error - System ID unknown, specify with --SID or " + \
                 "in configuration file")
             sys.exit(2)
         volumes = self.validate_cloud_volumes(cloud_volumes, subscription_id,
-            credentials, snapshot_name, verbose)
+            credentials, snapshot_name)
 
         # open HANA backup
-        open_backup_internal(snapshot_name, system_id, userstore_key, verbose)
+        open_backup_internal(snapshot_name, system_id, userstore_key)
 
         try:
             result = self.create_snapshot_internal(volumes, cloud_volumes,
-                subscription_id, credentials, snapshot_name, verbose)
+                subscription_id, credentials, snapshot_name)
         except:
             result = False
 
         # close HANA backup
         close_backup_internal(snapshot_name, system_id, userstore_key, \
-            result, verbose)
+            result)
 
     #
     # Find a mount point on the host for a cloud volume
     #
-    def get_mount_point(self, cloud_volume, subscription_id, credentials, 
-        verbose):
-        cloud_volume_candidate = run_command(["/bin/findmnt", cloud_volume, \
-            "-no", "SOURCE"], False, return_result=True, suppress_error=True)
-        if cloud_volume_candidate != HANA_NOT_RUNNING:
+    def get_mount_point(self, cloud_volume, subscription_id, credentials):
+        if self.get_source(cloud_volume):
             return cloud_volume
 
         if not subscription_id:
@@ -609,21 +1069,14 @@ class ANF():
             print("Error - KEY_FILE not found, specify path")
             sys.exit(2)
 
-        volume = self.get_volume(cloud_volume, subscription_id, credentials, 
-            verbose)
+        volume = self.get_volume(cloud_volume, subscription_id, credentials)
         if not volume:
             print("Volume '" + cloud_volume + "' not found")
             sys.exit(2)
 
-        export = volume.creation_token
         # the volume must be mounted by our host in order to restore from it
-        with open('/proc/mounts', 'r') as file:
-            for line in file.readlines():
-                filesystem = line.split()[0]
-                if len(filesystem.split("/")) == 2 and \
-                    filesystem.split("/")[1] == export:
-                    mount_point = line.split()[1]
-                    break
+        self.get_mounts()
+        mount_point = self.exports.get(volume.creation_token)
 
         if not mount_point:
             print("Volume '" + cloud_volume + \
@@ -637,25 +1090,73 @@ class ANF():
     # - the database must be stopped first
     #
     def restore(self, cloud_volume, snapshot, system_id, userstore_key, auth,
-        client_id, verbose):
+        client_id, revert=False):
         credentials = auth
         subscription_id = client_id
 
-        if is_hana_running(system_id, userstore_key, verbose):
+        if is_hana_running(system_id, userstore_key):
             print("Error - database must be stopped before it can be restored")
             sys.exit(2)
 
+        # with --revert, newer versions of the SDK revert the volume to the
+        # snapshot on the service, which takes seconds instead of copying
+        # every byte, but deletes the snapshots newer than the one restored
+        if revert:
+            if not subscription_id or not credentials:
+                print("Error - credentials and subscription id required " + \
+                    "to revert a volume")
+                sys.exit(2)
+            anf_client = self.get_client(AzureNetAppFilesManagementClient,
+                credentials, subscription_id)
+            if not hasattr(anf_client.volumes, "revert"):
+                print("Error - the installed Azure SDK can't revert " + \
+                    "volumes, restore without --revert")
+                sys.exit(2)
+            self.revert(anf_client, cloud_volume, snapshot,
+                subscription_id, credentials)
+            return
+
+        print("Restoring by copying from snapshot '" + snapshot + "'")
         mount_point = self.get_mount_point(cloud_volume, subscription_id, 
-            credentials, verbose)
+            credentials)
+
+        restore_internal(mount_point, snapshot)
+
+    #
+    # Revert a cloud volume to one of its snapshots
+    #
+    def revert(self, anf_client, cloud_volume, snapshot, subscription_id,
+        credentials):
+        volume = self.get_volume(cloud_volume, subscription_id, credentials)
+        if not volume:
+            print("Error - volume '" + cloud_volume + "' not found")
+            sys.exit(2)
+
+        resource_group, netapp_account, capacity_pool = \
+            self.parse_volume_id(volume)
+        volume_name = volume.creation_token
+        try:
+            snap = anf_client.snapshots.get(resource_group, netapp_account,
+                capacity_pool, volume_name, snapshot)
+        except:
+            print("Error - snapshot '" + snapshot + "' not found")
+            sys.exit(2)
 
-        restore_internal(mount_point, snapshot, verbose)
+        print("Reverting volume '" + volume_name + "' to snapshot '" + \
+            snapshot + "', newer snapshots are deleted")
+        start_time = time.perf_counter()
+        anf_client.volumes.revert(resource_group, netapp_account,
+            capacity_pool, volume_name, snapshot_id=snap.id).result()
+        elapsed = time.perf_counter() - start_time
+        print("Restore complete in " + str(round(elapsed, 6)) + \
+            " seconds")
 
     #
     # Provision a new cloud volume which is a clone of the snapshot of
     # another cloud volume
     #
     def clone(self, cloud_volume, snapshot, volume_name, export_path, cidr,
-        auth, client_id, verbose):
+        auth, client_id):
         credentials = auth
         subscription_id = client_id
 
@@ -671,36 +1172,31 @@ class ANF():
             print("Error - \"subscription_id\" unknown, specify in " + \
                 "configiuration file")
             sys.exit(2)
-        if not volume_name:
-            print("Error - VOLUME_NAME is a required argument")
-            sys.exit(2)
-        volume = self.get_volume(volume_name, subscription_id, credentials, 
-            False)
-        if volume:
-            print("Error - volume '" + volume_name + "' already exists")
-            sys.exit(2)
-        if not cloud_volume:
-            print("Error - CLOUD_VOLUME is a required argument")
-            sys.exit(2)
-        volume = self.get_volume(cloud_volume, subscription_id, credentials, 
-            verbose)
+        volume = self.get_volume(cloud_volume, subscription_id, credentials)
         if not volume:
             print("Error - volume '" + cloud_volume + "' not found")
             sys.exit(2)
-        if not snapshot:
-            print("Error - SNAPSHOT is a required argument")
+
+        # the clone is created in the capacity pool of the source volume, so
+        # that is where the new name must not be taken yet
+        anf_client = self.get_client(AzureNetAppFilesManagementClient,
+            credentials, subscription_id)
+        resource_group, netapp_account, capacity_pool = \
+            self.parse_volume_id(volume)
+        try:
+            anf_client.volumes.get(resource_group, netapp_account,
+                capacity_pool, volume_name)
+            print("Error - volume '" + volume_name + "' already exists")
             sys.exit(2)
+        except CloudError:
+            pass
+
         snapshot_id = self.get_snapshot_id(subscription_id, credentials, 
-            volume, snapshot, verbose)
+            volume, snapshot)
         if not snapshot_id:
             print("Error - snapshot '" + snapshot + "' not found")
             sys.exit(2)
 
-        anf_client = AzureNetAppFilesManagementClient(credentials,
-            subscription_id)
-        resource_group, netapp_account, capacity_pool = \
-            self.parse_volume_id(volume)
-
         volume_body = Volume(
             location = volume.location,
             usage_threshold = volume.usage_threshold,
@@ -709,22 +1205,21 @@ class ANF():
             service_level = volume.service_level,
             subnet_id = volume.subnet_id
         )
-        start_time = datetime.datetime.now()
+        start_time = time.perf_counter()
         try:
             anf_client.volumes.create_or_update(volume_body, 
                 resource_group, netapp_account, capacity_pool, 
                 volume_name)
-            elapsed = datetime.datetime.now() - start_time
+            elapsed = time.perf_counter() - start_time
             print("Created clone '" + volume_name + "' in " + \
-                str(elapsed.total_seconds()) + " seconds")
+                str(round(elapsed, 6)) + " seconds")
         except:
             print("Error - clone failed to initialize: '" + volume_name + "'")
 
     #
     # List the snapshots of a cloud volume
     #
-    def list_snapshots(self, cloud_volume, system_id, auth, client_id,
-        verbose):
+    def list_snapshots(self, cloud_volume, system_id, auth, client_id):
         credentials = auth
         subscription_id = client_id
 
@@ -733,17 +1228,13 @@ class ANF():
             print("Error - \"subscription_id\" unknown, specify in " + \
                 "configiuration file")
             sys.exit(2)
-        if not cloud_volume:
-            print("Error - CLOUD_VOLUME is a required argument")
-            sys.exit(2)
-        volume = self.get_volume(cloud_volume, subscription_id, credentials, 
-            verbose)
+        volume = self.get_volume(cloud_volume, subscription_id, credentials)
         if not volume:
             print("Error - volume '" + cloud_volume + "' not found")
             sys.exit(2)
 
-        anf_client = AzureNetAppFilesManagementClient(credentials,
-            subscription_id)
+        anf_client = self.get_client(AzureNetAppFilesManagementClient,
+            credentials, subscription_id)
 
         resource_group, netapp_account, capacity_pool =  \
             self.parse_volume_id(volume)
@@ -753,22 +1244,20 @@ class ANF():
             netapp_account, capacity_pool, cloud_volume)
 
         # use a standard library to format the table
-        row_format ="{:>30} {:>30}"
-        print(row_format.format("Name", "Created"))
+        # - rows are printed as the pages of snapshots are returned
+        row_format = "{:>30} {:>30}".format
+        print(row_format("Name", "Created"))
         for snapshot in snapshots:
-            try:
-                date = str(snapshot.created)
-            except:
-                # the python 2 version of the SDK doesn't return creation dates
-                date = "None"
-            print(row_format.format(snapshot.name.split("/")[3], date))
+            # the python 2 version of the SDK doesn't return creation dates
+            print(row_format(snapshot.name.rpartition("/")[2],
+                str(getattr(snapshot, "created", "None"))))
 
     #
     # Delete a snapshot 
     # - snapshots which are the bases of clones cannot be deleted
     #
     def delete_snapshot(self, cloud_volume, snapshot_name, all_previous, 
-        system_id, auth, client_id, verbose):
+        system_id, auth, client_id):
         credentials = auth
         subscription_id = client_id
 
@@ -777,57 +1266,71 @@ class ANF():
             print("Error - \"subscription_id\" unknown, specify in " + \
                 "configiuration file")
             sys.exit(2)
-        if not cloud_volume:
-            print("Error - CLOUD_VOLUME is a required argument")
-            sys.exit(2)
-        if not snapshot_name:
-            print("Error - SNAPSHOT is a required argument")
-            sys.exit(2)
-        volume = self.get_volume(cloud_volume, subscription_id, credentials,
-             verbose)
+        volume = self.get_volume(cloud_volume, subscription_id, credentials)
         if not volume:
             print("Error - volume '" + cloud_volume + "' not found")
             sys.exit(2)
 
-        anf_client = AzureNetAppFilesManagementClient(credentials,
-            subscription_id)
+        anf_client = self.get_client(AzureNetAppFilesManagementClient,
+            credentials, subscription_id)
         resource_group, netapp_account, capacity_pool =  \
             self.parse_volume_id(volume)
-        try:
-            snapshot = anf_client.snapshots.get(resource_group,
-                netapp_account, capacity_pool, cloud_volume, snapshot_name)
-        except:
-            print("Error - snapshot '" + snapshot_name + "' not found")
-            sys.exit(2)
+        cloud_volume = volume.creation_token
 
         # get a list of all snapshot we might want to delete
         if all_previous:
+            # the list also contains the requested snapshot, so there is no
+            # need to look it up separately
+            snapshots = self.get_snapshots(subscription_id, credentials,
+                volume)
+            snapshot = None
+            for candidate in snapshots:
+                if candidate.name.split("/")[-1] == snapshot_name:
+                    snapshot = candidate
+            if not snapshot:
+                print("Error - snapshot '" + snapshot_name + "' not found")
+                sys.exit(2)
             try:
                 created = snapshot.created
-                if verbose:
-                    print("Delete all snapshots before " + str(created))
-                snapshots = anf_client.snapshots.list(resource_group, 
-                    netapp_account, capacity_pool, cloud_volume)
+                log.debug("Delete all snapshots before %s", created)
             except:
                 # the python 2 version of the SDK doesn't return creation dates
                 print("Error - no creation dates found on snapshots, " + \
                     "no snapshots deleted")
                 sys.exit(2)
-            for candidate in snapshots:
-                date = candidate.created
-                if date <= created:
-                    if verbose:
-                        print("Delete snapshot: " + candidate.name)
+            candidates = [candidate for candidate in snapshots
+                if candidate.created <= created]
+
+            def delete(candidate):
+                log.debug("Delete snapshot: %s", candidate.name)
+                anf_client.snapshots.delete(resource_group, netapp_account,
+                    capacity_pool, cloud_volume,
+                    candidate.name.rpartition("/")[2]).result()
+
+            # the snapshots are deleted in parallel, errors are reported once
+            # all deletes have finished
+            errors = []
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(MAX_WORKERS, len(candidates))) as executor:
+                futures = [executor.submit(delete, candidate)
+                    for candidate in candidates]
+                for candidate, future in zip(candidates, futures):
                     try:
-                        anf_client.snapshots.delete(resource_group,
-                            netapp_account, capacity_pool, cloud_volume, 
-                            candidate.name.split("/")[3])
+                        future.result()
                         print("Snapshot '" + candidate.name + "' deleted")
-                    except:
-                        print("Error - '" + candidate.name + "' not deleted")
+                    except Exception as ex:
+                        log.debug("%s", ex)
+                        errors.append(candidate.name)
+            for name in errors:
+                print("Error - '" + name + "' not deleted")
         else:
-            if verbose:
-                print("Delete snapshot: " + snapshot.name)
+            try:
+                snapshot = anf_client.snapshots.get(resource_group,
+                    netapp_account, capacity_pool, cloud_volume, snapshot_name)
+            except:
+                print("Error - snapshot '" + snapshot_name + "' not found")
+                sys.exit(2)
+            log.debug("Delete snapshot: %s", snapshot.name)
             try:
                 anf_client.snapshots.delete(resource_group,
                     netapp_account, capacity_pool, cloud_volume, snapshot_name)
@@ -835,129 +1338,434 @@ class ANF():
             except:
                 print("Error - '" + snapshot_name + "' not deleted")
 
-if __name__ == "__main__":
-    # create platform-specific object
-    CVS = ANF()
+#
+# Command line arguments
+#
+# Every action and option is accepted; options an action doesn't use are
+# ignored, and if several actions are given the first one in this table is
+# run. The help only shows the action found on the command line and its
+# options. If no action is found, the help lists all of them.
+#
+ACTIONS = {
+    "--hana-backup": ("-b", ("cloud_volumes", "backup_name", "userstore_key",
+        "batch_size")),
+    "--create-snapshot": ("-s", ("cloud_volumes", "snapshot_name",
+        "batch_size")),
+    "--open-backup": ("-o", ("userstore_key", "EBID")),
+    "--close-backup": ("-e", ("userstore_key", "EBID")),
+    "--restore": ("-r", ("userstore_key", "cloud_volume", "snapshot",
+        "revert")),
+    "--clone": ("-l", ("userstore_key", "cloud_volume", "snapshot",
+        "volume_name", "export_path", "CIDR")),
+    "--list-snapshots": ("-L", ("cloud_volume",)),
+    "--delete-snapshot": ("-x", ("cloud_volume", "snapshot", "all_previous",
+        "batch_size")),
+}
+SHORT_ACTIONS = {short: flag for flag, (short, _) in ACTIONS.items()}
+# the names of the actions in the parsed arguments
+ACTION_NAMES = tuple(flag[2:].replace("-", "_") for flag in ACTIONS)
+
+# the options shared by every action
+COMMON_OPTIONS = ("SID", "key_file", "config_file", "subscription_id",
+    "dump_args", "verbose")
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--hana-backup", "-b", action="store_true",
-        help="Usage: ntaphana --hana-backup \
-        [--cloud-volumes CLOUD_VOLUMES] [--backup-name BACKUP_NAME] \
-        [--SID SID] [--userstore-key USERSTORE_KEY] \
-        [--key-file KEY_FILE] [--config-file CONFIG_FILE] [--verbose] \
-        create a consistent backup of a HANA database and a backing snapshot \
-        of the cloud volume or volumes")
-    parser.add_argument("--create-snapshot", "-s", action="store_true",
-        help="Usage: ntaphana --create-snapshot \
-        [--cloud-volumes CLOUD_VOLUMES] [--snapshot-name SNAPSHOT_NAME] \
-        [--SID SID] [--key-file KEY_FILE] \
-        [--config-file CONFIG_FILE] [--verbose] \
-        create a snapshot of the cloud volume or volumes")
-    parser.add_argument("--open-backup", "-o", action="store_true",
-        help="Usage: ntaphana --open-backup [--EBID EBID] \
-        [--SID SID] [--userstore-key USERSTORE_KEY] \
-        [--config-file CONFIG_FILE] [--verbose] start a backup of HANA and \
-        set the EBID as the comment")
-    parser.add_argument("--close-backup", "-e", action="store_true",
-        help="Usage: ntaphana --close-backup [--EBID EBID] \
-        [--SID SID] [--userstore-key USERSTORE_KEY] \
-        [--config-file CONFIG_FILE] [--verbose] close a backup of HANA and \
-        set the EBID as the comment")
-    parser.add_argument("--restore", "-r", action="store_true",
-        help="Usage: ntaphana --restore --cloud-volume CLOUD_VOLUME \
-        --snapshot SNAPSHOT [--SID SID] [--userstore-key USERSTORE_KEY] \
-        [--key-file KEY_FILE] [--config-file CONFIG_FILE] [--verbose] \
-        restore data by copying from a snapshot into the active filesystem; \
-        database must be stopped first and this command must be run on the \
-        host where the database is running")
-    parser.add_argument("--clone", "-l", action="store_true",
-        help="Usage: ntaphana --clone --cloud-volume CLOUD_VOLUME \
-        --snapshot SNAPSHOT --volume-name VOLUME_NAME \
-        [--export-path EXPORT_PATH] [--CIDR CIDR] [--SID SID] \
-        [--userstore-key USERSTORE_KEY] [--key-file KEY_FILE] \
-        [--config-file CONFIG_FILE] [--verbose] \
-        create a volume from a snapshot; specify the volume and \
-        snapshot to be cloned and the name of the new volume")
-    parser.add_argument("--list-snapshots", "-L", action="store_true",
-        help="Usage: ntaphana --list-snapshots --cloud-volume CLOUD_VOLUME \
-        [--SID SID] [--key-file KEY_FILE] [--config-file CONFIG_FILE] \
-        [--verbose] \
-        list the snapshots of a cloud volume")
-    parser.add_argument("--delete-snapshot", "-x", action="store_true",
-        help="Usage: ntaphana --delete-snapshot --cloud-volume CLOUD_VOLUME \
-        --snapshot SNAPSHOT [--all-previous] [--SID SID] [--key-file KEY_FILE] \
-        [--config-file CONFIG_FILE] [--verbose] \
-        permanently delete a snapshot of a cloud volume; use the \
-        'all-previous' flag with caution")
-    parser.add_argument("--cloud-volumes", "-c", help="the name of a mount \
-        point or a cloud volume or a comma-separated list")
-    parser.add_argument("--backup-name", "-p", help="both the \
-        external backup id and the name of the snapshot")
-    parser.add_argument("--SID", "-i", help="the System ID of a HANA database")
-    parser.add_argument("--userstore-key", "-y", help="a userstore key with \
-        the permissions required to administer HANA")
-    parser.add_argument("--key-file", "-k", help="the name of a file \
-        containing credentials appropriate to the cloud provider; a path may \
-        be specified; by default, a file named \"key.json\" in the local \
-        directory will be used")
-    parser.add_argument("--config-file", "-f", help="the name of a file \
-        which may contain a project number, SID, hdbuserstore key, list \
-        of cloud volumes or virtual private cloud; by default, the local \
-        directory will be searched for a file named \"SID_config.json\" \
-        or \"config.json\", where SID is the System ID of the HANA database")
-    parser.add_argument("--verbose", "-v", action="store_true",
-        help="show execution details")
-    parser.add_argument("--snapshot-name", "-n", help="name of the snapshot")
-    parser.add_argument("--EBID", "-d", help="external backup id")
-    parser.add_argument("--cloud-volume", "-g", help="the name of a mount \
-        point or a cloud volume")
-    parser.add_argument("--snapshot", "-j", help="the name of a snapshot")
-    parser.add_argument("--volume-name", "-u", help="name of the volume to \
-        create")
-    parser.add_argument("--export-path", "-a", help="export path of the clone; \
-        if not specified, the name of the new volume will be used as the \
-        export path")
-    parser.add_argument("--CIDR", "-z", help="CIDR format describing hosts to \
-        export to with full permission; if not specified 0.0.0.0/0 will be \
-        used")
-    parser.add_argument("--all-previous", "-P", action="store_true",
-        help="delete all previous snapshots as well as the specified snapshot; \
-        use with caution")
-    args = parser.parse_args()
-
-    # load the authentication headers from the key file
-    auth = CVS.get_auth(args.key_file, args.verbose)
-    # load the configuration from the config file
-    client_id, system_id, userstore_key, cloud_volumes, network = \
-        CVS.get_config(args.config_file, args.key_file, args.SID, 
-        args.userstore_key, args.cloud_volumes, args.verbose)
-
-    if args.hana_backup:
-        CVS.hana_backup(cloud_volumes, args.backup_name, system_id, 
-            userstore_key, auth, client_id, args.verbose)
-    elif args.create_snapshot:
-        CVS.create_snapshot(cloud_volumes, args.snapshot_name, system_id, 
-            auth, client_id, args.verbose)
-    elif args.open_backup:
-        open_backup(args.EBID, system_id, userstore_key, args.verbose)
-    elif args.close_backup:
-        close_backup(args.EBID, system_id, userstore_key, args.verbose)
-    elif args.restore:
-        CVS.restore(args.cloud_volume, args.snapshot, system_id, userstore_key,
-            auth, client_id, args.verbose)
-    elif args.clone:
-        CVS.clone(args.cloud_volume, args.snapshot, args.volume_name,
-            args.export_path, args.CIDR, auth, client_id, args.verbose)
-    elif args.list_snapshots:
-        CVS.list_snapshots(args.cloud_volume, system_id, auth, client_id, 
-            args.verbose)
-    elif args.delete_snapshot:
-        CVS.delete_snapshot(args.cloud_volume, args.snapshot, args.all_previous,
-            system_id, auth, client_id, args.verbose)
+#
+# The arguments each action can't do without, they are checked before any
+# file is read
+#
+REQUIRED_ARGUMENTS = {
+    "--restore": ("cloud_volume", "snapshot"),
+    "--clone": ("volume_name", "cloud_volume", "snapshot"),
+    "--list-snapshots": ("cloud_volume",),
+    "--delete-snapshot": ("cloud_volume", "snapshot"),
+}
+
+#
+# The values each action needs from the configuration; if they are all given
+# on the command line, the configuration file isn't read
+#
+REQUIRED_CONFIG_KEYS = {
+    "--hana-backup": ("subscription_id", "SID", "userstore_key",
+        "cloud_volumes"),
+    "--create-snapshot": ("subscription_id", "cloud_volumes"),
+    "--open-backup": ("SID", "userstore_key"),
+    "--close-backup": ("SID", "userstore_key"),
+    "--restore": ("subscription_id", "SID", "userstore_key"),
+    "--clone": ("subscription_id",),
+    "--list-snapshots": ("subscription_id",),
+    "--delete-snapshot": ("subscription_id",),
+}
+
+# the actions which only run SQL statements, they don't use the Azure SDK or
+# the key file
+HANA_ACTIONS = ("--open-backup", "--close-backup")
+
+OPTIONS = {
+    "cloud_volumes": (("--cloud-volumes", "-c"), {}),
+    "backup_name": (("--backup-name", "-p"), {}),
+    "SID": (("--SID", "-i"), {}),
+    "userstore_key": (("--userstore-key", "-y"), {}),
+    "key_file": (("--key-file", "-k"), {}),
+    "config_file": (("--config-file", "-f"), {}),
+    "subscription_id": (("--subscription-id", "-S"), {}),
+    "verbose": (("--verbose", "-v"), {"action": "store_true"}),
+    "snapshot_name": (("--snapshot-name", "-n"), {}),
+    "EBID": (("--EBID", "-d"), {}),
+    "cloud_volume": (("--cloud-volume", "-g"), {}),
+    "snapshot": (("--snapshot", "-j"), {}),
+    "volume_name": (("--volume-name", "-u"), {}),
+    "export_path": (("--export-path", "-a"), {}),
+    "CIDR": (("--CIDR", "-z"), {}),
+    "all_previous": (("--all-previous", "-P"), {"action": "store_true"}),
+    "revert": (("--revert",), {"action": "store_true"}),
+    "batch_size": (("--batch-size", "-B"), {"type": int}),
+    "dump_args": (("--dump-args",), {}),
+}
+
+#
+# Return the help of the actions and options
+# - the strings are only built when argparse is used, to print the help
+#
+def get_help():
+    return {
+        "verbs": "the actions may also be given as verbs: backup, backup \
+            open, backup close, snapshot create, snapshot list, snapshot \
+            delete, restore and clone, or the name of the flag without \
+            dashes, for example \"ntaphana snapshot list\"",
+        "--hana-backup": "Usage: ntaphana --hana-backup \
+            [--cloud-volumes CLOUD_VOLUMES] [--backup-name BACKUP_NAME] \
+            [--SID SID] [--userstore-key USERSTORE_KEY] \
+            [--key-file KEY_FILE] [--config-file CONFIG_FILE] \
+            [--subscription-id SUBSCRIPTION_ID] \
+            [--batch-size BATCH_SIZE] [--verbose] \
+            create a consistent backup of a HANA database and a backing \
+            snapshot of the cloud volume or volumes",
+        "--create-snapshot": "Usage: ntaphana --create-snapshot \
+            [--cloud-volumes CLOUD_VOLUMES] [--snapshot-name SNAPSHOT_NAME] \
+            [--SID SID] [--key-file KEY_FILE] \
+            [--config-file CONFIG_FILE] \
+            [--subscription-id SUBSCRIPTION_ID] [--batch-size BATCH_SIZE] \
+            [--verbose] create a snapshot of the cloud volume or volumes",
+        "--open-backup": "Usage: ntaphana --open-backup [--EBID EBID] \
+            [--SID SID] [--userstore-key USERSTORE_KEY] \
+            [--config-file CONFIG_FILE] [--verbose] start a backup of HANA \
+            and set the EBID as the comment",
+        "--close-backup": "Usage: ntaphana --close-backup [--EBID EBID] \
+            [--SID SID] [--userstore-key USERSTORE_KEY] \
+            [--config-file CONFIG_FILE] [--verbose] close a backup of HANA \
+            and set the EBID as the comment",
+        "--restore": "Usage: ntaphana --restore --cloud-volume CLOUD_VOLUME \
+            --snapshot SNAPSHOT [--SID SID] [--userstore-key USERSTORE_KEY] \
+            [--key-file KEY_FILE] [--config-file CONFIG_FILE] \
+            [--subscription-id SUBSCRIPTION_ID] [--revert] [--verbose] \
+            restore data by copying from a snapshot into the active \
+            filesystem, or with --revert, by reverting the volume to the \
+            snapshot; database must be stopped first and this command \
+            must be run on the host where the database is running",
+        "--clone": "Usage: ntaphana --clone --cloud-volume CLOUD_VOLUME \
+            --snapshot SNAPSHOT --volume-name VOLUME_NAME \
+            [--export-path EXPORT_PATH] [--CIDR CIDR] [--SID SID] \
+            [--userstore-key USERSTORE_KEY] [--key-file KEY_FILE] \
+            [--config-file CONFIG_FILE] \
+            [--subscription-id SUBSCRIPTION_ID] [--verbose] \
+            create a volume from a snapshot; specify the volume and \
+            snapshot to be cloned and the name of the new volume",
+        "--list-snapshots": "Usage: ntaphana --list-snapshots \
+            --cloud-volume CLOUD_VOLUME [--SID SID] [--key-file KEY_FILE] \
+            [--config-file CONFIG_FILE] \
+            [--subscription-id SUBSCRIPTION_ID] [--verbose] \
+            list the snapshots of a cloud volume",
+        "--delete-snapshot": "Usage: ntaphana --delete-snapshot \
+            --cloud-volume CLOUD_VOLUME --snapshot SNAPSHOT [--all-previous] \
+            [--SID SID] [--key-file KEY_FILE] [--config-file CONFIG_FILE] \
+            [--subscription-id SUBSCRIPTION_ID] \
+            [--batch-size BATCH_SIZE] [--verbose] \
+            permanently delete a snapshot of a cloud volume; use the \
+            'all-previous' flag with caution",
+        "cloud_volumes": "the name of a mount point or a cloud volume or a \
+            comma-separated list",
+        "backup_name": "both the external backup id and the name of the \
+            snapshot",
+        "SID": "the System ID of a HANA database",
+        "userstore_key": "a userstore key with the permissions required to \
+            administer HANA",
+        "key_file": "the name of a file containing credentials appropriate \
+            to the cloud provider; a path may be specified; by default, a \
+            file named \"key.json\" in the local directory will be used",
+        "config_file": "the name of a file which may contain a project \
+            number, SID, hdbuserstore key, list of cloud volumes or virtual \
+            private cloud; by default, the local directory will be searched \
+            for a file named \"SID_config.json\" or \"config.json\", where \
+            SID is the System ID of the HANA database",
+        "subscription_id": "the Azure subscription id; by default, the \
+            subscription_id in the configuration file, or the first \
+            subscription the credentials have access to",
+        "verbose": "show execution details",
+        "snapshot_name": "name of the snapshot",
+        "EBID": "external backup id",
+        "cloud_volume": "the name of a mount point or a cloud volume",
+        "snapshot": "the name of a snapshot",
+        "volume_name": "name of the volume to create",
+        "export_path": "export path of the clone; if not specified, the \
+            name of the new volume will be used as the export path",
+        "CIDR": "CIDR format describing hosts to export to with full \
+            permission; if not specified 0.0.0.0/0 will be used",
+        "all_previous": "delete all previous snapshots as well as the \
+            specified snapshot; use with caution",
+        "revert": "revert the cloud volume to the snapshot on the service \
+            instead of copying the files; faster, but all snapshots newer \
+            than the restored one are permanently deleted",
+        "batch_size": "the most cloud volumes or snapshots to look up, \
+            create or delete in parallel; by default, 8",
+        "dump_args": "save the checked command line in a file and exit; \
+            run it later with \"ntaphana --args-from DUMP_ARGS\", which \
+            skips parsing and checking the command line",
+    }
+
+#
+# Return the action flag of the parsed arguments, or None if there isn't one
+#
+def get_action(args):
+    for flag, name in zip(ACTIONS, ACTION_NAMES):
+        if getattr(args, name):
+            return flag
+    return None
+
+#
+# Return the action flag on the command line, or None if there isn't one
+#
+def find_action(argv):
+    for arg in argv:
+        if arg in ACTIONS:
+            return arg
+        if arg in SHORT_ACTIONS:
+            return SHORT_ACTIONS[arg]
+    return None
+
+#
+# The actions may also be given as verbs, such as "ntaphana snapshot list" or
+# "ntaphana list-snapshots", which are rewritten to the flags
+# - the flags remain supported, so existing scripts keep working
+#
+VERBS = {
+    ("backup",): "--hana-backup",
+    ("backup", "open"): "--open-backup",
+    ("backup", "close"): "--close-backup",
+    ("snapshot", "create"): "--create-snapshot",
+    ("snapshot", "list"): "--list-snapshots",
+    ("snapshot", "delete"): "--delete-snapshot",
+    ("restore",): "--restore",
+    ("clone",): "--clone",
+}
+
+def normalize_argv(argv):
+    if argv and "--" + argv[0] in ACTIONS:
+        return ["--" + argv[0]] + argv[1:]
+    for length in (2, 1):
+        flag = VERBS.get(tuple(argv[:length]))
+        if flag:
+            return [flag] + argv[length:]
+    return argv
+
+#
+# Parse the command line without argparse
+# - returns None if the command line needs argparse: no action, help,
+#   unknown or abbreviated options, or missing values, so that argparse
+#   prints the help or reports the error
+#
+OPTION_FLAGS = {name: dest for dest, (names, _) in OPTIONS.items()
+    for name in names}
+SWITCHES = {dest for dest, (_, kwargs) in OPTIONS.items()
+    if kwargs.get("action") == "store_true"}
+DEFAULTS = dict.fromkeys(ACTION_NAMES, False)
+DEFAULTS.update((dest, False if dest in SWITCHES else None)
+    for dest in OPTIONS)
+
+def parse_argv(argv):
+    if not find_action(argv):
+        return None
+
+    values = dict(DEFAULTS)
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        flag = SHORT_ACTIONS.get(arg, arg)
+        if flag in ACTIONS:
+            values[flag[2:].replace("-", "_")] = True
+            continue
+        name, equals, value = arg.partition("=")
+        if not name.startswith("--"):
+            name, equals, value = arg, "", ""
+        dest = OPTION_FLAGS.get(name)
+        if not dest:
+            return None
+        if dest in SWITCHES:
+            if equals:
+                return None
+            values[dest] = True
+            continue
+        if not equals:
+            if i == len(argv) or argv[i].startswith("-"):
+                return None
+            value = argv[i]
+            i += 1
+        try:
+            values[dest] = OPTIONS[dest][1].get("type", str)(value)
+        except ValueError:
+            return None
+    return types.SimpleNamespace(**values)
+
+def create_parser(argv):
+    # argparse is only needed for help and errors
+    import argparse
+
+    action = find_action(argv)
+    flags = [action] if action else list(ACTIONS)
+
+    # the help is added here, so it only lists what was registered
+    help = get_help()
+    parser = argparse.ArgumentParser(add_help=False, epilog=help["verbs"])
+    parser.add_argument("--help", "-h", action="help",
+        help="show this help message and exit")
+
+    options = set(COMMON_OPTIONS)
+    for flag, (short, action_options) in ACTIONS.items():
+        if flag in flags:
+            options.update(action_options)
+        parser.add_argument(flag, short, action="store_true",
+            help=help[flag] if flag in flags else argparse.SUPPRESS)
+    for dest, (names, kwargs) in OPTIONS.items():
+        parser.add_argument(*names, help=help[dest] if dest in options
+            else argparse.SUPPRESS, **kwargs)
+    return parser
+
+#
+# Run the actions
+# - every handler takes the same arguments, and picks the ones its action
+#   needs
+#
+def run_hana_backup(args, cvs, auth, client_id, system_id, userstore_key,
+    cloud_volumes):
+    cvs.hana_backup(cloud_volumes, args.backup_name, system_id, userstore_key,
+        auth, client_id)
+
+def run_create_snapshot(args, cvs, auth, client_id, system_id, userstore_key,
+    cloud_volumes):
+    cvs.create_snapshot(cloud_volumes, args.snapshot_name, system_id, auth,
+        client_id)
+
+def run_open_backup(args, cvs, auth, client_id, system_id, userstore_key,
+    cloud_volumes):
+    open_backup(args.EBID, system_id, userstore_key)
+
+def run_close_backup(args, cvs, auth, client_id, system_id, userstore_key,
+    cloud_volumes):
+    close_backup(args.EBID, system_id, userstore_key)
+
+def run_restore(args, cvs, auth, client_id, system_id, userstore_key,
+    cloud_volumes):
+    cvs.restore(args.cloud_volume, args.snapshot, system_id, userstore_key,
+        auth, client_id, args.revert)
+
+def run_clone(args, cvs, auth, client_id, system_id, userstore_key,
+    cloud_volumes):
+    cvs.clone(args.cloud_volume, args.snapshot, args.volume_name,
+        args.export_path, args.CIDR, auth, client_id)
+
+def run_list_snapshots(args, cvs, auth, client_id, system_id, userstore_key,
+    cloud_volumes):
+    cvs.list_snapshots(args.cloud_volume, system_id, auth, client_id)
+
+def run_delete_snapshot(args, cvs, auth, client_id, system_id, userstore_key,
+    cloud_volumes):
+    cvs.delete_snapshot(args.cloud_volume, args.snapshot, args.all_previous,
+        system_id, auth, client_id)
+
+# the handler of each action flag, the action is known once the arguments
+# are parsed, so its handler is called directly
+HANDLERS = {
+    "--hana-backup": run_hana_backup,
+    "--create-snapshot": run_create_snapshot,
+    "--open-backup": run_open_backup,
+    "--close-backup": run_close_backup,
+    "--restore": run_restore,
+    "--clone": run_clone,
+    "--list-snapshots": run_list_snapshots,
+    "--delete-snapshot": run_delete_snapshot,
+}
+
+if __name__ == "__main__":
+    argv = normalize_argv(sys.argv[1:])
+    loaded = len(argv) == 2 and argv[0] == "--args-from"
+    if loaded:
+        try:
+            with open(argv[1]) as file:
+                args = types.SimpleNamespace(**dict(DEFAULTS,
+                    **json_loads(file.read())))
+        except (OSError, ValueError):
+            print("File '" + argv[1] + "' not found or failed to load")
+            sys.exit(2)
     else:
+        args = parse_argv(argv)
+        if not args:
+            args = create_parser(argv).parse_args(argv)
+    action = get_action(args)
+
+    # nothing is read or imported when there is nothing to do
+    if not action:
         print("Error: specify --hana-backup, --create-snapshot, " + \
             "--open-backup, --close-backup, --restore, --clone, " + \
             "--list-snapshots, or --delete-snapshot")
+        sys.exit(2)
+
+    # loaded arguments were checked when they were saved
+    if not loaded:
+        if args.batch_size is not None and args.batch_size < 1:
+            print("Error - BATCH_SIZE must be at least 1")
+            sys.exit(2)
+        for dest in REQUIRED_ARGUMENTS.get(action, ()):
+            if not getattr(args, dest):
+                print("Error - " + dest.upper() + " is a required argument")
+                sys.exit(2)
+
+        if args.dump_args:
+            values = dict(vars(args), dump_args=None)
+            with open(args.dump_args, "w") as file:
+                json.dump(values, file)
+            sys.exit(0)
+
+    # only our own messages are shown with --verbose, not the SDK's
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    log.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    if args.batch_size is not None:
+        MAX_WORKERS = args.batch_size
+
+    # create platform-specific object
+    # - the SDK is only imported and the credentials only loaded for the
+    #   actions which call Azure
+    uses_azure = action not in HANA_ACTIONS
+    if uses_azure:
+        import_libraries()
+    CVS = ANF()
+
+    try:
+        # load the authentication headers from the key file
+        auth = None
+        if uses_azure:
+            auth = CVS.get_auth(args.key_file)
+        # load the configuration from the config file
+        client_id, system_id, userstore_key, cloud_volumes, network = \
+            CVS.get_config(args.config_file, args.key_file, args.SID, 
+            args.userstore_key, args.cloud_volumes,
+            args.subscription_id, REQUIRED_CONFIG_KEYS.get(action))
+
+        HANDLERS[action](args, CVS, auth, client_id, system_id,
+            userstore_key, cloud_volumes)
+    finally:
+        # release the connections held by the management clients
+        CVS.close()
 
 
 
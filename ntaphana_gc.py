@@ -73,25 +73,70 @@
 #
 # HANA and OS Interface Functions
 #
-import os, sys
+import os, pwd, re, sys
 import argparse
+import concurrent.futures
 import datetime, time
+import functools
+import io
+import json
+import shlex
 import subprocess
+import threading
 from subprocess import check_call, check_output, CalledProcessError
 
 #
 # Dynamically detect the platform we're running on by looking for the
 # proper libraries
+# - they are only imported once the command line has been parsed, so the
+#   help and argument errors don't wait for them
 #
-try:
-    import google.auth
-    import google.auth.transport.requests
-    from google.auth import jwt
-    from google.oauth2 import service_account
-    from google.oauth2 import id_token
-except:
-    print("Error - proper libraries not found, see installation instructions")
-    sys.exit(2)
+def import_libraries():
+    global google, jwt, service_account, id_token, requests, HTTPAdapter, \
+        RETRIES, httpx
+    try:
+        import google.auth
+        import google.auth.transport.requests
+        from google.auth import jwt
+        from google.oauth2 import service_account
+        from google.oauth2 import id_token
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+    except:
+        print("Error - proper libraries not found, see installation " + \
+            "instructions")
+        sys.exit(2)
+
+    RETRIES = Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES, raise_on_status=False)
+
+    #
+    # httpx is optional, with it (and h2) the requests of a command, including
+    # the parallel ones, share a single HTTP/2 connection rather than each
+    # opening their own
+    #
+    try:
+        import httpx
+        import h2
+    except ImportError:
+        httpx = None
+
+#
+# The SAP HANA client for python is optional, without it we use hdbsql
+# - it is only imported when the first statement is run, so the actions
+#   which don't use HANA don't pay for it
+#
+dbapi = None
+
+@functools.lru_cache(maxsize=None)
+def import_hdbcli():
+    global dbapi
+    try:
+        from hdbcli import dbapi
+    except:
+        dbapi = None
+    return dbapi
 
 #
 # Function for running commands
@@ -103,10 +148,12 @@ HANA_NOT_RUNNING = "HANA not running"
 def run_command(command, verbose, return_result=False, suppress_error=False, 
     system_id=False):
     try:
+        # the command is only joined into a string for the shell of su, and
+        # for printing when verbose
         if system_id:
             hdbuser = system_id.lower() + "adm"
-            command = ['su', '-', hdbuser, '-c'] + \
-                [" ".join(str(x) for x in command)]
+            command = ('su', '-', hdbuser, '-c',
+                " ".join(shlex.quote(str(x)) for x in command))
         if verbose:
             print("calling: " + " ".join(str(x) for x in command))
             if return_result:
@@ -117,64 +164,192 @@ def run_command(command, verbose, return_result=False, suppress_error=False,
             else:
                 check_call(command)
         else:
-            with open(os.devnull, 'w') as DEVNULL:
-                if return_result:
-                    bytestring = check_output(command, stderr=DEVNULL)
-                    output = bytestring.decode('utf-8')
-                    return output
-                else:
-                    check_call(command, stdout=DEVNULL, stderr=DEVNULL)
+            if return_result:
+                bytestring = check_output(command, stderr=subprocess.DEVNULL)
+                output = bytestring.decode('utf-8')
+                return output
+            else:
+                check_call(command, stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
     except CalledProcessError as ex:
         if suppress_error:
             return HANA_NOT_RUNNING
         print("Error code: " + str(ex.returncode))
         sys.exit(2)
 
+#
+# Decode the octal escapes (e.g. "\\040" for a space) used by the kernel for
+# the fields of /proc/self/mountinfo
+#
+MOUNT_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+def unescape_mount_field(field):
+    if "\\" not in field:
+        return field
+    return MOUNT_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field)
+
 #
 # Define SQL prefix
 #
-HDBSQL = ['hdbsql', '-U']
+HDBSQL = ('hdbsql', '-U')
+
+#
+# SQL statements
+# - the templates are bound str.format methods, filled in by the callers
+#
+GET_DATABASE_STATUSES = "SELECT DATABASE_NAME, ACTIVE_STATUS FROM " + \
+    "SYS.M_DATABASES"
+GET_BACKUP_ID = "SELECT BACKUP_ID FROM M_BACKUP_CATALOG WHERE " + \
+    "ENTRY_TYPE_NAME = 'data snapshot' AND STATE_NAME = 'prepared'"
+OPEN_BACKUP = ("BACKUP DATA FOR FULL SYSTEM CREATE SNAPSHOT " + \
+    "COMMENT '{}'").format
+CLOSE_BACKUP = ("BACKUP DATA FOR FULL SYSTEM CLOSE SNAPSHOT " + \
+    "BACKUP_ID {} {} '{}'").format
+STOP_TENANT = "ALTER SYSTEM STOP DATABASE {}".format
+
+#
+# The values we need are found in the output of hdbsql without splitting all
+# of it: the quoted name and status of each database and the first number
+# after the column header
+#
+DATABASE_STATUS = re.compile(r'^"([^"]*)","([^"]*)"', re.MULTILINE)
+NUMBER_VALUE = re.compile(r'\b(\d+)\b')
 
-def is_hana_running(system_id, userstore_key, verbose):
-    GET_HANA_STATUS = "SELECT ACTIVE_STATUS FROM SYS.M_DATABASES"
+#
+# Run a SQL statement and return the rows of its result as tuples of strings
+#
+# If the SAP HANA client for python (hdbcli) is installed, one connection is
+# opened with the userstore key and kept for the rest of the command, rather
+# than starting su and hdbsql for every statement. Otherwise, or if the
+# connection can't be opened, the statement is run with hdbsql and the rows
+# are the groups of the matches of pattern in its output.
+#
+# Returns no rows for statements without a pattern, and None if the
+# statement failed and suppress_error is set. If first_only is set, only the
+# first row is fetched.
+#
+HDB_CONNECTIONS = {}
+
+def get_hdb_connection(system_id, userstore_key, verbose):
+    key = (system_id, userstore_key)
+    if key in HDB_CONNECTIONS:
+        return HDB_CONNECTIONS[key]
+    # $HOME is shared by all threads, so it's only changed while no other
+    # thread is running, otherwise the statement is run with hdbsql
+    if threading.active_count() > 1:
+        return None
+
+    connection = None
+    if system_id and import_hdbcli():
+        # the userstore belongs to the hdbuser and is found through $HOME
+        home = os.environ.get("HOME")
+        try:
+            os.environ["HOME"] = \
+                pwd.getpwnam(system_id.lower() + "adm").pw_dir
+            connection = dbapi.connect(key=userstore_key)
+        except Exception as ex:
+            if verbose:
+                print("hdbcli connection failed, using hdbsql: " + str(ex))
+        finally:
+            if home is None:
+                del os.environ["HOME"]
+            else:
+                os.environ["HOME"] = home
+    HDB_CONNECTIONS[key] = connection
+    return connection
+
+def run_sql_rows(sql, system_id, userstore_key, verbose, pattern=None,
+    suppress_error=False, first_only=False):
+    connection = get_hdb_connection(system_id, userstore_key, verbose)
+    if connection:
+        if verbose:
+            print("executing: " + sql)
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(sql)
+                rows = []
+                if pattern and cursor.description:
+                    if first_only:
+                        row = cursor.fetchone()
+                        rows = [row] if row else []
+                    else:
+                        rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        except dbapi.Error as ex:
+            if suppress_error:
+                return None
+            print("Error - " + str(ex))
+            sys.exit(2)
+        return [tuple(str(value) for value in row) for row in rows]
 
-    output = run_command(HDBSQL + [userstore_key] + [GET_HANA_STATUS],
-        verbose, True, True, system_id=system_id)
+    output = run_command((*HDBSQL, userstore_key, sql), verbose,
+        return_result=True, suppress_error=suppress_error, system_id=system_id)
     if output == HANA_NOT_RUNNING:
+        return None
+    if not pattern:
+        return []
+    if first_only:
+        match = pattern.search(output)
+        return [match.groups()] if match else []
+    return [match.groups() for match in pattern.finditer(output)]
+
+#
+# Run a SQL statement and return the first value of its result
+# - returns an empty string for statements without a pattern or without rows,
+#   and HANA_NOT_RUNNING if the statement failed and suppress_error is set
+#
+def run_sql(sql, system_id, userstore_key, verbose, pattern=None,
+    suppress_error=False):
+    rows = run_sql_rows(sql, system_id, userstore_key, verbose, pattern,
+        suppress_error, first_only=True)
+    if rows is None:
+        return HANA_NOT_RUNNING
+    return rows[0][0] if rows else ""
+
+#
+# Look up the state of every database in one query
+# - returns a dictionary of database names and their ACTIVE_STATUS, in the
+#   order returned by HANA (the system database first), or an empty
+#   dictionary if HANA is not running
+#
+def get_database_statuses(system_id, userstore_key, verbose):
+    rows = run_sql_rows(GET_DATABASE_STATUSES, system_id, userstore_key,
+        verbose, DATABASE_STATUS, suppress_error=True)
+    if rows is None:
+        return {}
+    return dict(rows)
+
+def is_hana_running(system_id, userstore_key, verbose, statuses=None):
+    if statuses is None:
+        statuses = get_database_statuses(system_id, userstore_key, verbose)
+    if not statuses:
         return False
-    output = output.split()[1]
-    if output == '"YES"':
+    status = next(iter(statuses.values()))
+    if status == "YES":
         return True
-    print("Error - database in unexpected state: " + output)
+    print("Error - database in unexpected state: " + status)
     sys.exit(2)
 
-def is_tenant_running(system_id, userstore_key, verbose):
-    GET_TENANT_STATUS = "SELECT ACTIVE_STATUS FROM SYS.M_DATABASES WHERE " + \
-        "DATABASE_NAME = \"'" + system_id + "'\""
-
-    output = run_command(HDBSQL + [userstore_key] + [GET_TENANT_STATUS], 
-        verbose, True, True, system_id=system_id)
-    if output == HANA_NOT_RUNNING:
-        return False
-    output = output.split()[1]
-    if output == '"YES"':
+def is_tenant_running(system_id, userstore_key, verbose, statuses=None):
+    if statuses is None:
+        statuses = get_database_statuses(system_id, userstore_key, verbose)
+    status = statuses.get(system_id)
+    if status == "YES":
         return True
-    elif output == '"NO"':
+    elif status == "NO" or status is None:
         return False
-    print("Error - tenant database in unexpected state: " + output)
+    print("Error - tenant database in unexpected state: " + status)
     sys.exit(2)
 
 #
 # To close an open backup, we first need to have the backup id
 #
 def get_backup_id(system_id, userstore_key, verbose):
-    GET_BACKUP_ID = "SELECT BACKUP_ID FROM M_BACKUP_CATALOG WHERE " + \
-        "ENTRY_TYPE_NAME = \"'data snapshot'\" AND STATE_NAME = \"'prepared'\""
-
-    output = run_command(HDBSQL + [userstore_key] + [GET_BACKUP_ID], verbose, 
-        return_result=True, system_id=system_id)
-    backup_id = output.split()[1]
-    if int(backup_id) == 0:
+    backup_id = run_sql(GET_BACKUP_ID, system_id, userstore_key, verbose,
+        NUMBER_VALUE)
+    if not backup_id or int(backup_id) == 0:
         print("Error: failed to find open snapshot")
         sys.exit(2)
     return backup_id
@@ -183,46 +358,45 @@ def get_backup_id(system_id, userstore_key, verbose):
 # Open a HANA backup
 #
 # We use this helper function so it can be called by other functions
+# - returns the backup id, which can be passed to close_backup_internal
 #
 def open_backup_internal(ebid, system_id, userstore_key, verbose):
-    OPEN_BACKUP = "BACKUP DATA FOR FULL SYSTEM CREATE SNAPSHOT COMMENT"
-
     if ebid:
-        comment = "'" + ebid + "'"
+        comment = ebid
     else:
-        comment = "'" + datetime.datetime.now().isoformat().replace(":","") + \
-            "'"
-    output = run_command(HDBSQL + [userstore_key] + [OPEN_BACKUP + " \"" + \
-        comment + "\""], verbose, system_id=system_id)
+        comment = datetime.datetime.now().isoformat().replace(":","")
+    run_sql(OPEN_BACKUP(comment), system_id, userstore_key, verbose)
+    return get_backup_id(system_id, userstore_key, verbose)
 
 #
 # This is the entry point for the command line option
 #
 def open_backup(ebid, system_id, userstore_key, verbose):
-    open_backup_internal(ebid, system_id, userstore_key, verbose)
-    backup_id = get_backup_id(system_id, userstore_key, verbose)
+    backup_id = open_backup_internal(ebid, system_id, userstore_key, verbose)
     print("Opened backup: " + backup_id)
 
 #
 # Close a HANA backup
 #
 # We use this helper function so it can be called by other functions
+# - the backup id is only looked up if the caller doesn't have it
 #
-def close_backup_internal(ebid, system_id, userstore_key, successful, verbose):
-    CLOSE_BACKUP = "BACKUP DATA FOR FULL SYSTEM CLOSE SNAPSHOT BACKUP_ID"
-
-    backup_id = get_backup_id(system_id, userstore_key, verbose)
+def close_backup_internal(ebid, system_id, userstore_key, successful, verbose,
+    backup_id=None, comment=None):
+    if not backup_id:
+        backup_id = get_backup_id(system_id, userstore_key, verbose)
     if successful:
         if ebid:
-            comment = "\"'" + ebid + "'\""
+            comment = ebid
         else:
-            comment = "\"'NetApp snapshot successful'\""
-        run_command(HDBSQL + [userstore_key] + [CLOSE_BACKUP] + [backup_id] + \
-            ["SUCCESSFUL"] + [comment], verbose, system_id=system_id)
+            comment = "NetApp snapshot successful"
+        run_sql(CLOSE_BACKUP(backup_id, "SUCCESSFUL", comment), system_id,
+            userstore_key, verbose)
     else:
-        comment = "\"'NetApp snapshot creation timed out'\""
-        run_command(HDBSQL + [userstore_key] + [CLOSE_BACKUP] + [backup_id] + \
-            ["UNSUCCESSFUL"] + [comment], verbose, system_id=system_id)
+        if not comment:
+            comment = "NetApp snapshot creation timed out"
+        run_sql(CLOSE_BACKUP(backup_id, "UNSUCCESSFUL", comment), system_id,
+            userstore_key, verbose)
     return backup_id
 
 #
@@ -234,24 +408,63 @@ def close_backup(ebid, system_id, userstore_key, verbose):
     print("Closed backup: " + backup_id)
 
 def stop_hana(system_id, userstore_key, verbose):
-    STOP_HANA = ["HDB", "stop"]
-    STOP_TENANT = "ALTER SYSTEM STOP DATABASE " + system_id
+    STOP_HANA = ("HDB", "stop")
 
-    if is_tenant_running(system_id, userstore_key, verbose):
-        run_command(HDBSQL + [userstore_key] + [STOP_TENANT], verbose, 
-            system_id=system_id)
+    # the states of the system and tenant databases are looked up together
+    statuses = get_database_statuses(system_id, userstore_key, verbose)
+    if is_tenant_running(system_id, userstore_key, verbose, statuses):
+        run_sql(STOP_TENANT(system_id), system_id, userstore_key, verbose)
         print("Stopped Tenant Database")
     else:
         print("Tenant Database not running")
     run_command(STOP_HANA, verbose, system_id=system_id)
     print("Stopped HANA")
 
+#
+# Options for copying a snapshot back into the active filesystem
+# - whole files are copied in place, computing deltas and compressing is
+#   only worth it over slow links, not between two paths of one mount
+# - the tuning options are only available in some builds of rsync, so they
+#   are only used if "rsync --help" lists them
+# - when verbose, progress is shown as a single line for the whole copy if
+#   rsync supports --info, rather than a line for every file
+#
+RSYNC = ["rsync", "-axH", "--delete", "--inplace", "--whole-file",
+    "--no-compress"]
+RSYNC_TUNING = ["--preallocate", "--max-map-size=4194304",
+    "--write-size=524288"]
+# the most rsync processes copying a snapshot in parallel
+RSYNC_WORKERS = min(8, os.cpu_count() or 1)
+
+@functools.lru_cache(maxsize=None)
+def get_rsync_command(verbose):
+    usage = run_command(["rsync", "--help"], False, return_result=True,
+        suppress_error=True)
+    command = RSYNC + [option for option in RSYNC_TUNING
+        if option.split("=")[0] in usage]
+    if verbose and "--info" in usage:
+        command += ["-h", "--info=progress2"]
+    elif verbose:
+        command += ["-hv", "--progress"]
+    return command
+
+#
+# Copy the output of a process to stdout as each line arrives
+# - the lines of parallel processes are written whole, and the carriage
+#   returns ending progress lines are kept
+#
+OUTPUT_LOCK = threading.Lock()
+
+def forward_output(process):
+    for line in io.TextIOWrapper(process.stdout, newline=''):
+        with OUTPUT_LOCK:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
 #
 # This helper function handles the OS-related restore steps
 #
 def restore_internal(mount_point, snapshot, verbose):
-    RSYNC = ["rsync", "-axhv", "--delete", "--progress"]
-
     if not mount_point:
         print("Error - volume '" + cloud_volume + "' not found: " +
             "insure the volume is mounted on the host where this command is " +
@@ -265,16 +478,186 @@ def restore_internal(mount_point, snapshot, verbose):
         print("Error - snapshot '" + snapshot + "' not found")
         sys.exit(2)
 
-    run_command(RSYNC + [source] + [destination], verbose)
+    rsync = get_rsync_command(verbose)
+
+    # the top level is copied first, without the contents of its directories,
+    # which also deletes the entries which aren't in the snapshot
+    run_command(rsync + ["--exclude=/*/*"] + [source] + [destination], verbose)
+
+    # the directories are then shared out between parallel rsync processes
+    directories = sorted(entry.name for entry in os.scandir(source)
+        if entry.is_dir(follow_symlinks=False))
+    workers = min(RSYNC_WORKERS, len(directories))
+    if verbose:
+        stdout, stderr = subprocess.PIPE, subprocess.STDOUT
+    else:
+        stdout, stderr = subprocess.DEVNULL, subprocess.DEVNULL
+    processes = [subprocess.Popen(rsync +
+        [source + name for name in directories[worker::workers]] +
+        [destination], stdout=stdout, stderr=stderr)
+        for worker in range(workers)]
+    if verbose:
+        forwarders = [threading.Thread(target=forward_output, args=(process,))
+            for process in processes]
+        for forwarder in forwarders:
+            forwarder.start()
+        for forwarder in forwarders:
+            forwarder.join()
+    return_codes = [process.wait() for process in processes]
+    for return_code in return_codes:
+        if return_code:
+            print("Error code: " + str(return_code))
+    if any(return_codes):
+        sys.exit(2)
     print("Restore complete")
 
-import json
-import requests
+#
+# orjson is optional, with it responses and the configuration and cache files
+# are parsed faster, and straight from the bytes received
+#
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 DEFAULT_SERVICE_ACCOUNT_FILE_NAME = 'key.json'
 DEFAULT_CONFIG_FILE_NAME = 'config.json'
 DEFAULT_USERSTORE_KEY = 'SYSTEM'
-DEFAULT_TIMEOUT = 5
+# snapshots are polled after 0.1, 0.2, 0.4, ... seconds, waiting at most 2
+# seconds between polls and giving up after 30 seconds
+POLL_TIMEOUT = 30
+POLL_INTERVAL = 0.1
+POLL_MAX_INTERVAL = 2.0
+# a clone takes longer to become available than a snapshot
+CLONE_POLL_TIMEOUT = 50
+# the most CVS requests we make in parallel
+MAX_WORKERS = 8
+# connections kept open to the API, deletions use all of them
+POOL_SIZE = 16
+# seconds to wait for the response to a deletion
+DELETE_TIMEOUT = 30
+# the most deletions sent per second, so deleting many snapshots stays under
+# the request quota of the API rather than being throttled
+DELETE_RATE = 20
+# seconds before its expiry at which a token is refreshed
+TOKEN_EXPIRY_MARGIN = 60
+# requests failing with these statuses are retried after 0.2, 0.4, ...
+# seconds, the last response is returned if they keep failing
+# - POST isn't retried, so a snapshot or clone is never requested twice
+# - the API returns 500 for transient backend errors as well
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 0.2
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+#
+# Create the transport of the httpx client
+# - httpx itself only retries failed connections, so the responses with
+#   one of the RETRY_STATUSES are retried here, the same way as the requests
+#   session retries them, waiting longer if the API asks for it with a
+#   Retry-After header
+#
+def create_httpx_transport():
+
+    class RetryTransport(httpx.HTTPTransport):
+
+        def handle_request(self, request):
+            delay = RETRY_BACKOFF_FACTOR
+            for attempt in range(RETRY_TOTAL):
+                response = super().handle_request(request)
+                if response.status_code not in RETRY_STATUSES or \
+                    request.method not in RETRY_METHODS:
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                response.close()
+                if retry_after.isdigit():
+                    time.sleep(max(delay, int(retry_after)))
+                else:
+                    time.sleep(delay)
+                delay *= 2
+            return super().handle_request(request)
+
+    return RetryTransport(http2=True, retries=RETRY_TOTAL,
+        limits=httpx.Limits(max_keepalive_connections=8))
+
+#
+# Disk cache of the snapshot lists shown by --list-snapshots
+# - a list is kept for DEFAULT_CACHE_TTL seconds (or --cache-ttl) between
+#   runs, so scripts listing the same volume repeatedly don't call the API
+#   every time
+# - creating or deleting snapshots with this script removes the list of the
+#   volume, so it is never shown without the change
+#
+SNAPSHOTS_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "ntaphana",
+    "snapshots")
+DEFAULT_CACHE_TTL = 60
+
+def get_snapshots_cache_path(project_number, region, volume_id):
+    return os.path.join(SNAPSHOTS_CACHE,
+        project_number + "_" + region + "_" + volume_id + ".json")
+
+def load_cache(path):
+    try:
+        with open(path, "rb") as file:
+            return json_loads(file.read())
+    except (OSError, ValueError):
+        return None
+
+def save_cache(path, cache, verbose):
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # write a new file and rename it, so readers never see a partial file
+        temp_path = path + "." + str(os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            json.dump(cache, file)
+        os.replace(temp_path, path)
+    except OSError as ex:
+        if verbose:
+            print("Failed to save cache '" + path + "': " + str(ex))
+
+def remove_cache(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+#
+# Call check until it returns a true value or timeout seconds have passed,
+# waiting with exponential backoff between the calls
+# - check is called one last time when the time is up
+# - returns the last value returned by check
+#
+def wait_for(check, timeout=POLL_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    delay = POLL_INTERVAL
+    while True:
+        result = check()
+        remaining = deadline - time.monotonic()
+        if result or remaining <= 0:
+            return result
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, POLL_MAX_INTERVAL)
+
+#
+# Limit the rate of requests shared by several threads
+# - up to rate requests are let through at once, the following ones are
+#   spaced evenly over each second
+#
+class RateLimiter():
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_time, now - 1.0 + self.interval)
+            self.next_time = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
 #
 # Google Cloud version of the CVS API
@@ -282,8 +665,84 @@ DEFAULT_TIMEOUT = 5
 
 AUDIENCE = 'https://cloudvolumesgcp-api.netapp.com'
 
+def get_snapshots_url(project_number, region, volume_id):
+    return AUDIENCE + "/v2/projects/" + project_number + "/locations/" + \
+        region + "/Volumes/" + volume_id + "/Snapshots"
+
 class CVS4GC():
 
+    def __init__(self):
+        # all of the requests of a command share one session, so connections
+        # to the API are kept open and reused rather than opened every time
+        # - like requests, the httpx client waits for responses without a
+        #   timeout, and retries the same statuses
+        if httpx:
+            self.session = httpx.Client(timeout=None,
+                transport=create_httpx_transport())
+        else:
+            self.session = requests.Session()
+            self.session.mount("https://", HTTPAdapter(
+                pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                max_retries=RETRIES))
+        # credentials are loaded and signed once per key file and audience,
+        # tokens about to expire are refreshed in the background
+        self.service_credentials = {}
+        self.config_cache = {}
+        self.jwt_credentials = {}
+        self.refreshing = set()
+        self.refresh_lock = threading.Lock()
+        self.refresh_executor = None
+        # the results of lookups are kept for the rest of the command, the
+        # entries are dropped when the command changes what they describe
+        self.project_number = None
+        self.volumes = {}
+        self.snapshots = {}
+        self.snapshot_etags = {}
+        self.snapshot_ids = {}
+        self.volumes_lock = threading.Lock()
+        self.mounts = None
+        self.exports = None
+
+    #
+    # Read the filesystems mounted on this host
+    # - /proc/self/mountinfo is parsed once per process, rather than calling
+    #   findmnt or scanning /proc/mounts for every volume
+    # - mounts maps each mount point to its source, exports maps the export
+    #   of each NFS source to the first mount point it was found on
+    #
+    def get_mounts(self):
+        if self.mounts is not None:
+            return self.mounts
+
+        mounts = {}
+        exports = {}
+        with open('/proc/self/mountinfo', 'r') as file:
+            for line in file:
+                fields = line.split()
+                # the optional fields end with a "-", which is followed by
+                # the filesystem type and the source
+                separator = fields.index("-", 6)
+                mount_point = unescape_mount_field(fields[4])
+                source = unescape_mount_field(fields[separator + 2])
+                mounts[mount_point] = source
+                path = source.split("/")
+                if len(path) == 2:
+                    exports.setdefault(path[1], mount_point)
+
+        # only publish complete maps, other threads may be reading them
+        self.exports = exports
+        self.mounts = mounts
+        return self.mounts
+
+    #
+    # Return the source of the filesystem mounted on cloud_volume, or an empty
+    # string if cloud_volume is not a mount point
+    #
+    def get_source(self, cloud_volume):
+        if cloud_volume.startswith("/"):
+            cloud_volume = os.path.realpath(cloud_volume)
+        return self.get_mounts().get(cloud_volume, "")
+
     #
     # Dynamically lookup the project number
     # - only works if the service account only has access to one project or 
@@ -292,19 +751,23 @@ class CVS4GC():
     def get_project_number(self, key_file, verbose):
         GC_AUDIENCE = 'https://cloudresourcemanager.googleapis.com'
 
+        if self.project_number:
+            return self.project_number
+
         gc_auth = self.get_auth(key_file, verbose, GC_AUDIENCE + "/")
         get_url = GC_AUDIENCE + "/v1/projects/"
-        r = requests.get(get_url, headers=gc_auth)
+        r = self.session.get(get_url, headers=gc_auth)
         if r.status_code != 200:
             if verbose:
                 print("Error retrieving project number from " + GC_AUDIENCE + \
                     " - " + r.text)
         else:
-            r_dict = r.json()
+            r_dict = json_loads(r.content)
             if r_dict.get('projects'):
                 projects = r_dict.get('projects')
                 project = projects[0]
                 project_number = project['projectNumber']
+                self.project_number = project_number
         return project_number
 
     #
@@ -323,9 +786,15 @@ class CVS4GC():
         if verbose:
             print("Loading configuration from '" + config_file + "'")
 
+        # the file is only parsed again if it has changed
         try:
-            with open(config_file) as file:
-                config = json.load(file)
+            key = (os.path.abspath(config_file),
+                os.stat(config_file).st_mtime_ns)
+            config = self.config_cache.get(key)
+            if config is None:
+                with open(config_file, "rb") as file:
+                    config = json_loads(file.read())
+                self.config_cache[key] = config
         except:
             if verbose:
                 print("File '" + config_file + "' not found or failed to load")
@@ -346,7 +815,10 @@ class CVS4GC():
             if not userstore_key:
                 userstore_key = DEFAULT_USERSTORE_KEY
         if not cloud_volumes:
+            # a copy, the list is changed while creating snapshots
             cloud_volumes = config.get("cloud_volumes")
+            if cloud_volumes:
+                cloud_volumes = list(cloud_volumes)
         else:
             cloud_volumes = cloud_volumes.split(",")
         network = config.get("network")
@@ -361,18 +833,27 @@ class CVS4GC():
         if not key_file:
             key_file = DEFAULT_SERVICE_ACCOUNT_FILE_NAME
 
+        # the key file is only read again if it has changed
         try:
-            service_credentials = \
-                service_account.Credentials.from_service_account_file(key_file)
+            key = (os.path.abspath(key_file), os.stat(key_file).st_mtime_ns)
+            service_credentials = self.service_credentials.get(key)
+            if not service_credentials:
+                service_credentials = service_account.Credentials.\
+                    from_service_account_file(key_file)
+                self.service_credentials[key] = service_credentials
         except:
             if verbose:
                 print("File '" + key_file + "' not found or failed to load")
             return ""
 
-        jwt_credentials = jwt.Credentials.from_signing_credentials(
-            service_credentials, audience=audience)
-        request = google.auth.transport.requests.Request()
-        jwt_credentials.refresh(request)
+        jwt_credentials = self.jwt_credentials.get((key, audience))
+        if not jwt_credentials:
+            jwt_credentials = jwt.Credentials.from_signing_credentials(
+                service_credentials, audience=audience)
+            jwt_credentials.refresh(google.auth.transport.requests.Request())
+            self.jwt_credentials[(key, audience)] = jwt_credentials
+        else:
+            self.refresh_credentials(jwt_credentials)
         auth_token = jwt_credentials.token
 
         auth = {
@@ -381,42 +862,93 @@ class CVS4GC():
         }
         return auth
 
+    #
+    # Refresh cached credentials which are about to expire
+    # - a token which is still valid is refreshed in the background and
+    # used in the meantime, an expired one is refreshed before returning
+    #
+    def refresh_credentials(self, jwt_credentials):
+        remaining = jwt_credentials.expiry - datetime.datetime.utcnow()
+        if remaining.total_seconds() > TOKEN_EXPIRY_MARGIN:
+            return
+
+        # the lock only guards refreshing, the refreshes themselves run
+        # without it, so other callers keep using the current token
+        request = google.auth.transport.requests.Request()
+        if remaining.total_seconds() <= 0:
+            jwt_credentials.refresh(request)
+            return
+
+        def refresh():
+            try:
+                jwt_credentials.refresh(request)
+            finally:
+                with self.refresh_lock:
+                    self.refreshing.discard(id(jwt_credentials))
+
+        # only the first caller to see the token going stale refreshes it
+        with self.refresh_lock:
+            if id(jwt_credentials) in self.refreshing:
+                return
+            self.refreshing.add(id(jwt_credentials))
+            if not self.refresh_executor:
+                self.refresh_executor = \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.refresh_executor.submit(refresh)
+
     #
     # cloud_volume could be a path to a mount point or the name of a
     # cloud volume, in either case, the volumes attributes are returned 
     #
-    def get_volume(self, cloud_volume, project_number, auth, verbose):
-        cloud_volume_candidate = run_command(["/bin/findmnt", cloud_volume, 
-            "-no", "SOURCE"], False, return_result=True, suppress_error=True)
-        if cloud_volume_candidate != HANA_NOT_RUNNING:
-            value = (cloud_volume_candidate.split("/")[1]).strip("\n")
+    def get_volume(self, cloud_volume, project_number, auth, verbose,
+        refresh=False):
+        source = self.get_source(cloud_volume)
+        if source:
+            value = source.split("/")[1]
             key = "creationToken"
         else:
             value = cloud_volume
             key = "name"
 
-        get_url = AUDIENCE + "/v2/projects/" + project_number + \
-            "/locations/-/Volumes"
-        r = requests.get(get_url, headers=auth)
-        if r.status_code != 200:
-            print("Error listing volumes - '" + r.text)
-            sys.exit(2)
-
-        r_dict = r.json()
-        for vol in r_dict:
+        for vol in self.get_volumes(project_number, auth, refresh):
             if vol[key] == value:
                 if verbose:
                     print("Found " + cloud_volume + " with volumeId = " + \
                         vol["volumeId"])
                 return vol
 
+    #
+    # List all cloud volumes of the project
+    # - the list is only retrieved once unless a refresh is requested
+    #
+    def get_volumes(self, project_number, auth, refresh=False):
+        with self.volumes_lock:
+            volumes = self.volumes.get(project_number)
+            if volumes is None or refresh:
+                get_url = AUDIENCE + "/v2/projects/" + project_number + \
+                    "/locations/-/Volumes"
+                r = self.session.get(get_url, headers=auth)
+                if r.status_code != 200:
+                    print("Error listing volumes - '" + r.text)
+                    sys.exit(2)
+                volumes = json_loads(r.content)
+                self.volumes[project_number] = volumes
+        return volumes
+
+    #
+    # Drop the snapshot list of a volume after changing its snapshots, both
+    # in this process and on disk
+    #
+    def forget_snapshots(self, project_number, region, volume_id):
+        self.snapshots.pop(volume_id, None)
+        remove_cache(get_snapshots_cache_path(project_number, region,
+            volume_id))
+
     #
     # Find a mount point on the host for a cloud volume
     #
     def get_mount_point(self, cloud_volume, project_number, auth, verbose):
-        cloud_volume_candidate = run_command(["/bin/findmnt", cloud_volume, \
-            "-no", "SOURCE"], False, return_result=True, suppress_error=True)
-        if cloud_volume_candidate != HANA_NOT_RUNNING:
+        if self.get_source(cloud_volume):
             return cloud_volume
 
         if not project_number:
@@ -432,15 +964,9 @@ class CVS4GC():
             print("Volume '" + cloud_volume + "' not found")
             sys.exit(2)
 
-        export = vol['creationToken']
         # the volume must be mounted by our host in order to restore from it
-        with open('/proc/mounts', 'r') as file:
-            for line in file.readlines():
-                filesystem = line.split()[0]
-                if len(filesystem.split("/")) == 2 and \
-                    filesystem.split("/")[1] == export:
-                    mount_point = line.split()[1]
-                    break
+        self.get_mounts()
+        mount_point = self.exports.get(vol['creationToken'])
 
         if not mount_point:
             print("Volume '" + cloud_volume + \
@@ -453,18 +979,43 @@ class CVS4GC():
     # Lookup the id for a snapshot
     #
     def get_snapshot_id(self, project_number, region, volume_id, snapshot_name, 
-        auth, verbose):
-        get_url = AUDIENCE + "/v2/projects/" + project_number + \
-            "/locations/" + region + "/Volumes/" + volume_id + "/Snapshots"
-        r = requests.get(get_url, headers=auth)
-        if r.status_code != 200:
-            print("Error listing snapshots - '" + r.text)
-            sys.exit(2)
+        auth, verbose, refresh=False):
+        snapshots = self.get_snapshots(project_number, region, volume_id, auth,
+            refresh)
+        # the ids are indexed by name once for each list of snapshots
+        snapshot_ids = self.snapshot_ids.get(volume_id)
+        if not snapshot_ids or snapshot_ids[0] is not snapshots:
+            snapshot_ids = (snapshots, dict((snapshot["name"],
+                snapshot["snapshotId"]) for snapshot in snapshots))
+            self.snapshot_ids[volume_id] = snapshot_ids
+        return snapshot_ids[1].get(snapshot_name)
 
-        r_dict = r.json()
-        for snapshot in r_dict:
-            if snapshot["name"] == snapshot_name:
-                return snapshot["snapshotId"]
+    #
+    # List the snapshots of a cloud volume
+    # - the list is only retrieved once unless a refresh is requested
+    # - a refresh only transfers the list if it has changed since it was
+    #   retrieved
+    #
+    def get_snapshots(self, project_number, region, volume_id, auth,
+        refresh=False):
+        snapshots = self.snapshots.get(volume_id)
+        if snapshots is None or refresh:
+            get_url = get_snapshots_url(project_number, region, volume_id)
+            headers = auth
+            etag = self.snapshot_etags.get(volume_id)
+            if snapshots is not None and etag:
+                headers = dict(auth)
+                headers["If-None-Match"] = etag
+            r = self.session.get(get_url, headers=headers)
+            if r.status_code == 304:
+                return snapshots
+            if r.status_code != 200:
+                print("Error listing snapshots - '" + r.text)
+                sys.exit(2)
+            self.snapshot_etags[volume_id] = r.headers.get("ETag")
+            snapshots = json_loads(r.content)
+            self.snapshots[volume_id] = snapshots
+        return snapshots
 
     #
     # Go through a list of snapshots to make sure they all exist and none
@@ -472,16 +1023,20 @@ class CVS4GC():
     #
     def validate_cloud_volumes(self, cloud_volumes, project_number, auth,
         snapshot_name, verbose):
+        # the volumes are looked up in parallel, the results are checked in
+        # the order of the list
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(MAX_WORKERS, len(cloud_volumes))) as executor:
+            futures = [executor.submit(self.lookup_cloud_volume, cloud_volume,
+                project_number, auth, snapshot_name, verbose)
+                for cloud_volume in cloud_volumes]
+            results = [future.result() for future in futures]
+
         volumes = {}
-        for cloud_volume in cloud_volumes:
-            vol = self.get_volume(cloud_volume, project_number, auth, verbose)
+        for cloud_volume, (vol, snapshot_id) in zip(cloud_volumes, results):
             if not vol:
                 print("Error - volume '" + cloud_volume + "' not found")
                 sys.exit(2)
-            region = vol["region"]
-            volume_id = vol["volumeId"]
-            snapshot_id = self.get_snapshot_id(project_number, region, 
-                volume_id, snapshot_name, auth, verbose)
             if snapshot_id:
                 print("Error - snapshot '" + snapshot_name + "' already exists")
                 sys.exit(2)
@@ -489,6 +1044,19 @@ class CVS4GC():
 
         return volumes
 
+    #
+    # Look up a cloud volume and the id of its snapshot of the given name
+    # - returns None for the volume if it isn't found
+    #
+    def lookup_cloud_volume(self, cloud_volume, project_number, auth,
+        snapshot_name, verbose):
+        vol = self.get_volume(cloud_volume, project_number, auth, verbose)
+        if not vol:
+            return None, None
+        snapshot_id = self.get_snapshot_id(project_number, vol["region"],
+            vol["volumeId"], snapshot_name, auth, verbose)
+        return vol, snapshot_id
+
     #
     # Create a snapshot of each cloud volume in the list 
     # - assumes the cloud volume list has already been validated
@@ -496,41 +1064,51 @@ class CVS4GC():
     def create_snapshot_internal(self, volumes, cloud_volumes, project_number,
         auth, snapshot_name, verbose):
 
-        start_time = datetime.datetime.now()
-        for cloud_volume in cloud_volumes:
+        def create(cloud_volume):
             vol = volumes[cloud_volume]
-            post_url = AUDIENCE + "/v2/projects/" + project_number + \
-                "/locations/" + vol["region"] + "/Volumes/" + \
-                vol["volumeId"] + "/Snapshots"
+            post_url = get_snapshots_url(project_number, vol["region"],
+                vol["volumeId"])
             payload = {
                 "name": snapshot_name
             }
-            requests.post(post_url, headers=auth, json=payload)
-
-        # wait for snapshots to be created
-        for x in range(DEFAULT_TIMEOUT):
-            pending_volumes = list(cloud_volumes)
-            for cloud_volume in pending_volumes:
-                vol = volumes[cloud_volume]
-                snapshot_id = self.get_snapshot_id(project_number, 
-                    vol["region"], vol["volumeId"], snapshot_name, auth, 
-                    False)
-                if snapshot_id:
-                    cloud_volumes.remove(cloud_volume)
-            if not cloud_volumes:
-                break
-            time.sleep(1)
-        elapsed = datetime.datetime.now() - start_time
+            self.forget_snapshots(project_number, vol["region"],
+                vol["volumeId"])
+            return self.session.post(post_url, headers=auth, json=payload)
+
+        def find(cloud_volume):
+            vol = volumes[cloud_volume]
+            return self.get_snapshot_id(project_number, vol["region"],
+                vol["volumeId"], snapshot_name, auth, False, refresh=True)
+
+        # the snapshots are requested, and then polled, for all volumes in
+        # parallel
+        start_time = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(MAX_WORKERS, len(cloud_volumes))) as executor:
+            list(executor.map(create, cloud_volumes))
+
+            def created():
+                pending_volumes = list(cloud_volumes)
+                snapshot_ids = executor.map(find, pending_volumes)
+                for cloud_volume, snapshot_id in zip(pending_volumes,
+                    snapshot_ids):
+                    if snapshot_id:
+                        cloud_volumes.remove(cloud_volume)
+                return not cloud_volumes
+
+            # wait for snapshots to be created
+            wait_for(created)
+        elapsed = round(time.monotonic() - start_time, 6)
 
         if cloud_volumes:
             print("Error - snapshot '" + snapshot_name + \
-                "' not created after " + str(elapsed.total_seconds()) + \
+                "' not created after " + str(elapsed) + \
                 " seconds on the following volume(s): " + \
-                ", ".join(pending_volumes))
+                ", ".join(cloud_volumes))
             return False
         else:
             print("Created snapshot '" + snapshot_name + "' in " + \
-                str(elapsed.total_seconds()) + " seconds")
+                str(elapsed) + " seconds")
             return True
 
     #
@@ -585,18 +1163,31 @@ class CVS4GC():
             print("Error - System ID unknown, specify with --SID or " + \
                 "in configuration file")
             sys.exit(2)
-        volumes = self.validate_cloud_volumes(cloud_volumes, project_number,
-            auth, snapshot_name, verbose)
-
-        # open HANA backup
-        open_backup_internal(snapshot_name, system_id, userstore_key, verbose)
+        # open HANA backup, while the cloud volumes are validated
+        # - the hdbcli connection is opened before the threads start
+        get_hdb_connection(system_id, userstore_key, verbose)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            validation = executor.submit(self.validate_cloud_volumes,
+                cloud_volumes, project_number, auth, snapshot_name, verbose)
+            opening = executor.submit(open_backup_internal, snapshot_name,
+                system_id, userstore_key, verbose)
+            concurrent.futures.wait((validation, opening))
+        backup_id = opening.result()
+        try:
+            volumes = validation.result()
+        except:
+            # no snapshot will be created, so close the backup again
+            close_backup_internal(snapshot_name, system_id, userstore_key,
+                False, verbose, backup_id,
+                "NetApp snapshot not created, cloud volume validation failed")
+            raise
 
         successful = self.create_snapshot_internal(volumes, cloud_volumes, 
             project_number, auth, snapshot_name, verbose)
 
         # close HANA backup
         close_backup_internal(snapshot_name, system_id, userstore_key, \
-            successful, verbose)
+            successful, verbose, backup_id)
 
     #
     # Copy the contents of a snapshot into the active filesystem
@@ -683,14 +1274,15 @@ class CVS4GC():
             "snapshotId": snapshot_id
         }
 
-        start_time = datetime.datetime.now()
-        r = requests.post(post_url, json=payload, headers=auth)
+        start_time = time.monotonic()
+        r = self.session.post(post_url, json=payload, headers=auth)
+        self.volumes.pop(project_number, None)
         if r.status_code != 201 and r.status_code != 202:
             print("Error creating clone - '" + r.text)
             sys.exit(2)
 
-        results = r.json()
-        elapsed = datetime.datetime.now() - start_time
+        results = json_loads(r.content)
+        elapsed = round(time.monotonic() - start_time, 6)
 
         if results.get("message"):
             print("Error creating clone - '" + results['message'])
@@ -698,29 +1290,30 @@ class CVS4GC():
         if verbose:
             print("Waiting for clone '" + volume_name + "'")
 
-        # Wait for clone to be available - 10 times the default timeout
-        for x in range(DEFAULT_TIMEOUT * 10):
-            try:
-                vol = self.get_volume(volume_name, project_number, auth, False)
-                if vol["lifeCycleState"] != 'creating':
-                    break
-            except:
-                pass
-            time.sleep(1)
-
-        if vol["lifeCycleState"] != 'available':
+        def initialized():
+            vol = self.get_volume(volume_name, project_number, auth, False,
+                refresh=True)
+            if vol and vol["lifeCycleState"] != 'creating':
+                return vol
+
+        # Wait for clone to be available
+        vol = wait_for(initialized, CLONE_POLL_TIMEOUT)
+
+        if not vol:
+            print("Error - clone '" + volume_name + "' still not available")
+        elif vol["lifeCycleState"] != 'available':
             print("Error - clone failed to initialize: '" + \
                 vol["lifeCycleStateDetails"] + "'")
         else:
             print("Created clone '" + volume_name + "' in " + \
-                str(elapsed.total_seconds()) + " seconds")
+                str(elapsed) + " seconds")
 
     #
     # List the snapshots of a cloud volume, including their names, creation
     # date and how much storage is "locked" in them.
     #
     def list_snapshots(self, cloud_volume, system_id, auth, project_number, 
-        verbose):
+        verbose, cache_ttl=DEFAULT_CACHE_TTL):
 
         # validate arguments
         if not project_number:
@@ -737,16 +1330,23 @@ class CVS4GC():
         region = vol["region"]
         volume_id = vol["volumeId"]
 
-        get_url = AUDIENCE + "/v2/projects/" + project_number + \
-            "/locations/" + region + "/Volumes/" + volume_id + \
-            "/Snapshots"
-        r = requests.get(get_url, headers=auth)
-        if r.status_code != 200:
-            print("Error listing snapshots - '" + r.text)
-            sys.exit(2)
+        # a list saved less than cache_ttl seconds ago is shown as it is
+        path = get_snapshots_cache_path(project_number, region, volume_id)
+        r_dict = None
+        try:
+            if time.time() - os.stat(path).st_mtime < cache_ttl:
+                r_dict = load_cache(path)
+        except OSError:
+            pass
+        if r_dict is None:
+            r_dict = self.get_snapshots(project_number, region, volume_id,
+                auth)
+            if cache_ttl > 0:
+                save_cache(path, r_dict, verbose)
+        elif verbose:
+            print("Using snapshots cached in '" + path + "'")
 
         # use a standard library to format the table
-        r_dict = r.json()
         row_format ="{:>30} {:>30} {:>10}"
         print(row_format.format("Name", "Created", "Used MB"))
         for snapshot in r_dict:
@@ -759,7 +1359,7 @@ class CVS4GC():
     # - snapshots which are the bases of clones cannot be deleted
     #
     def delete_snapshot(self, cloud_volume, snapshot, all_previous, system_id, 
-        auth, project_number, verbose):
+        auth, project_number, verbose, max_parallel=POOL_SIZE):
 
         # validate arguments
         if not project_number:
@@ -779,171 +1379,368 @@ class CVS4GC():
             sys.exit(2)
         region = vol["region"]
         volume_id = vol["volumeId"]
-        snapshot_id = self.get_snapshot_id(project_number, region, volume_id,
-            snapshot, auth, verbose)
-        if not snapshot_id:
+        # the snapshot and, with all_previous, the ones to delete with it are
+        # found in one list of the snapshots of the volume
+        snapshots = self.get_snapshots(project_number, region, volume_id, auth)
+        requested = None
+        for snap in snapshots:
+            if snap['name'] == snapshot:
+                requested = snap
+                break
+        if not requested:
             print("Error - snapshot '" + snapshot + "' not found")
             sys.exit(2)
 
-        # get a list of all snapshot we might want to delete
-        if all_previous:
-            get_url = AUDIENCE + "/v2/projects/" + project_number + \
-                "/locations/" + region + "/Volumes/" + volume_id + \
-                "/Snapshots"
-            r = requests.get(get_url, headers=auth)
-            if r.status_code != 200:
-                print("Error listing snapshots - '" + r.text)
-                sys.exit(2)
-            deletion_list = r.json()
-        else:
-            get_url = AUDIENCE + "/v2/projects/" + project_number + \
-                "/locations/" + region + "/Volumes/" + volume_id + \
-                "/Snapshots/" + snapshot_id
-            r = requests.get(get_url, headers=auth)
-            if r.status_code != 200:
-                print("Error listing snapshot - '" + r.text)
-                sys.exit(2)
-            tmp = r.json()
-            deletion_list = [tmp]
-
         # get the date before which we will delete all snapshots        
-        for snap in deletion_list:
-            if snap['snapshotId'] == snapshot_id:
-                created = snap['created']
-                if verbose and all_previous:
-                    print("Delete all snapshots before " + created)
+        created = requested['created']
         if not created:
             print("Error - failed to find creation date of requested " +
                 "snaphot: " + snapshot)
             sys.exit(2)
-
-        # request deletions in parallel
-        start_time = datetime.datetime.now()
-        deletion_candidates = list(deletion_list)
-        for snap in deletion_candidates:
-            if snap['created'] <= created:
-                if verbose:
-                    print("Delete snapshot: " + snap['name'])
-                delete_url = AUDIENCE + "/v2/projects/" + project_number + \
-                    "/locations/" + region + "/Volumes/" + volume_id + \
-                    "/Snapshots/" + snap['snapshotId']
-                r = requests.delete(delete_url, headers=auth)
-                if r.status_code != 200 and r.status_code != 202:
-                    print("Error deleting snapshot - '" + r.text)
-            else:
-                deletion_list.remove(snap)
+        if all_previous:
+            if verbose:
+                print("Delete all snapshots before " + created)
+            deletion_list = snapshots
+        else:
+            deletion_list = [requested]
+
+        # returns the error, if the deletion failed
+        # - the snapshots share the start of their URLs, which is only built
+        #   once
+        snapshots_url = get_snapshots_url(project_number, region,
+            volume_id) + "/"
+        limiter = RateLimiter(DELETE_RATE)
+        def delete(snap):
+            limiter.wait()
+            if verbose:
+                print("Delete snapshot: " + snap['name'])
+            delete_url = snapshots_url + snap['snapshotId']
+            try:
+                r = self.session.delete(delete_url, headers=auth,
+                    timeout=DELETE_TIMEOUT)
+            except Exception as ex:
+                return str(ex)
+            if r.status_code != 200 and r.status_code != 202:
+                return r.text
+
+        # request deletions in parallel without waiting for the responses,
+        # each round of the wait drops the requests which failed in the
+        # meantime and the snapshots which are gone from the list
+        # - the snapshots still being deleted are kept by name, so they can
+        #   be dropped without searching for them
+        start_time = time.monotonic()
+        pending = {snap['name']: snap for snap in deletion_list
+            if snap['created'] <= created}
+        executor = None
+        futures = {}
+        errors = []
+        if pending:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(max_parallel, len(pending)))
+            for name, snap in pending.items():
+                futures[name] = executor.submit(delete, snap)
+            self.forget_snapshots(project_number, region, volume_id)
+
+        def check_requests():
+            for name, future in list(futures.items()):
+                if future.done():
+                    del futures[name]
+                    if future.cancelled():
+                        error = "cancelled"
+                    else:
+                        error = future.result()
+                    # a snapshot already seen as deleted needs no error
+                    if error and name in pending:
+                        errors.append("'" + name + "' - " + error)
+                        del pending[name]
+
+        def deleted():
+            check_requests()
+            if not pending:
+                return True
+
+            # the snapshots are listed once per round and the pending ones
+            # are looked up in the names of the list
+            names = set(snap['name'] for snap in self.get_snapshots(
+                project_number, region, volume_id, auth, refresh=True))
+            for name in [name for name in pending if name not in names]:
+                print("Snapshot '" + name + "' deleted")
+                del pending[name]
+            return not pending
 
         # wait for snapshot to be deleted
-        for x in range(DEFAULT_TIMEOUT):
-            pending_list = list(deletion_list)
-            for snap in pending_list:
-                snapshot_id = self.get_snapshot_id(project_number, region, 
-                    volume_id, snap['name'], auth, verbose)
-                if not snapshot_id:
-                    print("Snapshot '" + snap['name'] + "' deleted")
-                    deletion_list.remove(snap)
-            if not deletion_list:
-                break
-            time.sleep(1)
-        elapsed = datetime.datetime.now() - start_time
-
-        if deletion_list:
+        # - the deletions can't all be sent faster than DELETE_RATE per
+        #   second, so the wait is extended by the time it takes to send them
+        wait_for(deleted, POLL_TIMEOUT + len(pending) / DELETE_RATE)
+
+        # when we give up, the deletions not sent yet are cancelled and the
+        # ones being sent are waited for, so nothing is deleted after the
+        # result is reported
+        if executor:
+            if pending:
+                for future in futures.values():
+                    future.cancel()
+            executor.shutdown(wait=True)
+            check_requests()
+        elapsed = round(time.monotonic() - start_time, 6)
+        for error in errors:
+            print("Error deleting snapshot " + error)
+
+        if pending or errors:
             print("Error - not all snapshots deleted in " + \
-                str(elapsed.total_seconds()) + " seconds")
+                str(elapsed) + " seconds")
             sys.exit(2)
         if all_previous:
             print("All snapshots before and including '" + snapshot + \
-                "' deleted in " + str(elapsed.total_seconds()) + " seconds")
+                "' deleted in " + str(elapsed) + " seconds")
+
+#
+# Command line arguments
+#
+# Every action and option is accepted; options an action doesn't
+# use are ignored, and if several actions are given the first one in this
+# table is run. The help strings are only built for --help, and then only
+# the action found on the command line and its options are shown. If no
+# action is found, the help lists all of them.
+#
+ACTIONS = {
+    "--hana-backup": ("-b", ("cloud_volumes", "backup_name", "userstore_key")),
+    "--create-snapshot": ("-s", ("cloud_volumes", "snapshot_name")),
+    "--open-backup": ("-o", ("userstore_key", "EBID")),
+    "--close-backup": ("-e", ("userstore_key", "EBID")),
+    "--restore": ("-r", ("userstore_key", "cloud_volume", "snapshot")),
+    "--clone": ("-l", ("cloud_volume", "snapshot", "volume_name",
+        "export_path", "CIDR")),
+    "--list-snapshots": ("-L", ("cloud_volume", "cache_ttl", "no_cache")),
+    "--delete-snapshot": ("-x", ("cloud_volume", "snapshot", "all_previous",
+        "max_parallel")),
+}
+SHORT_ACTIONS = {short: flag for flag, (short, _) in ACTIONS.items()}
+
+# the options shared by every action
+COMMON_OPTIONS = ("SID", "key_file", "config_file", "verbose")
+
+OPTIONS = {
+    "cloud_volumes": (("--cloud-volumes", "-c"), {}),
+    "backup_name": (("--backup-name", "-p"), {}),
+    "SID": (("--SID", "-i"), {}),
+    "userstore_key": (("--userstore-key", "-y"), {}),
+    "key_file": (("--key-file", "-k"), {}),
+    "config_file": (("--config-file", "-f"), {}),
+    "verbose": (("--verbose", "-v"), {"action": "store_true"}),
+    "snapshot_name": (("--snapshot-name", "-n"), {}),
+    "EBID": (("--EBID", "-d"), {}),
+    "cloud_volume": (("--cloud-volume", "-g"), {}),
+    "snapshot": (("--snapshot", "-j"), {}),
+    "volume_name": (("--volume-name", "-u"), {}),
+    "export_path": (("--export-path", "-a"), {}),
+    "CIDR": (("--CIDR", "-z"), {}),
+    "all_previous": (("--all-previous", "-P"), {"action": "store_true"}),
+    "cache_ttl": (("--cache-ttl",), {"type": int,
+        "default": DEFAULT_CACHE_TTL}),
+    "no_cache": (("--no-cache",), {"action": "store_true"}),
+    "max_parallel": (("--max-parallel",), {"type": int,
+        "default": POOL_SIZE}),
+}
+
+#
+# Return the help of the actions and options
+# - the strings are only built when the help is requested, argument errors
+#   only show the usage
+#
+def get_help():
+    return {
+        "--hana-backup": "Usage: ntaphana --hana-backup \
+            [--cloud-volumes CLOUD_VOLUMES] [--backup-name BACKUP_NAME] \
+            [--SID SID] [--userstore-key USERSTORE_KEY] \
+            [--key-file KEY_FILE] [--config-file CONFIG_FILE] [--verbose] \
+            create a consistent backup of a HANA database and a backing \
+            snapshot of the cloud volume or volumes",
+        "--create-snapshot": "Usage: ntaphana --create-snapshot \
+            [--cloud-volumes CLOUD_VOLUMES] [--snapshot-name SNAPSHOT_NAME] \
+            [--SID SID] [--key-file KEY_FILE] \
+            [--config-file CONFIG_FILE] [--verbose] \
+            create a snapshot of the cloud volume or volumes",
+        "--open-backup": "Usage: ntaphana --open-backup [--EBID EBID] \
+            [--SID SID] [--userstore-key USERSTORE_KEY] \
+            [--config-file CONFIG_FILE] [--verbose] start a backup of HANA \
+            and set the EBID as the comment",
+        "--close-backup": "Usage: ntaphana --close-backup [--EBID EBID] \
+            [--SID SID] [--userstore-key USERSTORE_KEY] \
+            [--config-file CONFIG_FILE] [--verbose] close a backup of HANA \
+            and set the EBID as the comment",
+        "--restore": "Usage: ntaphana --restore --cloud-volume CLOUD_VOLUME \
+            --snapshot SNAPSHOT [--SID SID] [--userstore-key USERSTORE_KEY] \
+            [--key-file KEY_FILE] [--config-file CONFIG_FILE] [--verbose] \
+            restore data by copying from a snapshot into the active \
+            filesystem; database must be stopped first and this command \
+            must be run on the host where the database is running",
+        "--clone": "Usage: ntaphana --clone --cloud-volume CLOUD_VOLUME \
+            --snapshot SNAPSHOT --volume-name VOLUME_NAME \
+            [--export-path EXPORT_PATH] [--CIDR CIDR] [--SID SID] \
+            [--key-file KEY_FILE] [--config-file CONFIG_FILE] [--verbose] \
+            create a volume from a snapshot; specify the volume and \
+            snapshot to be cloned and the name of the new volume",
+        "--list-snapshots": "Usage: ntaphana --list-snapshots \
+            --cloud-volume CLOUD_VOLUME [--SID SID] [--key-file KEY_FILE] \
+            [--config-file CONFIG_FILE] [--cache-ttl CACHE_TTL] \
+            [--no-cache] [--verbose] list the snapshots of a cloud volume",
+        "--delete-snapshot": "Usage: ntaphana --delete-snapshot \
+            --cloud-volume CLOUD_VOLUME --snapshot SNAPSHOT --all-previous \
+            [--SID SID] [--key-file KEY_FILE] [--config-file CONFIG_FILE] \
+            [--max-parallel MAX_PARALLEL] [--verbose] permanently delete a \
+            snapshot of a cloud volume; use the 'all-previous' flag with \
+            caution",
+        "cloud_volumes": "the name of a mount point or a cloud volume or a \
+            comma-separated list",
+        "backup_name": "both the external backup id and the name of the \
+            snapshot",
+        "SID": "the System ID of a HANA database",
+        "userstore_key": "a userstore key with the permissions required to \
+            administer HANA",
+        "key_file": "the name of a file containing credentials appropriate \
+            to the cloud provider; a path may be specified; by default, a \
+            file named \"key.json\" in the local directory will be used",
+        "config_file": "the name of a file which may contain a project \
+            number, SID, hdbuserstore key, list of cloud volumes or virtual \
+            private cloud; by default, the local directory will be searched \
+            for a file named \"SID_config.json\" or \"config.json\", where \
+            SID is the System ID of the HANA database",
+        "verbose": "show execution details",
+        "snapshot_name": "name of the snapshot",
+        "EBID": "external backup id",
+        "cloud_volume": "the name of a mount point or a cloud volume",
+        "snapshot": "the name of a snapshot",
+        "volume_name": "name of the volume to create",
+        "export_path": "export path of the clone; if not specified, the \
+            name of the new volume will be used as the export path",
+        "CIDR": "CIDR format describing hosts to export to with full \
+            permission; if not specified 0.0.0.0/0 will be used",
+        "all_previous": "delete all previous snapshots as well as the \
+            specified snapshot; use with caution",
+        "cache_ttl": "seconds for which a list of snapshots is reused by \
+            later --list-snapshots commands; by default, " + \
+            str(DEFAULT_CACHE_TTL),
+        "no_cache": "always retrieve the list of snapshots from the cloud \
+            provider",
+        "max_parallel": "the most snapshot deletions to request in \
+            parallel, they are sent at most " + str(DELETE_RATE) + " per \
+            second; by default, " + str(POOL_SIZE),
+    }
+
+#
+# Return the action flag on the command line, or None if there isn't one
+#
+def find_action(argv):
+    for arg in argv:
+        if arg in ACTIONS:
+            return arg
+        if arg in SHORT_ACTIONS:
+            return SHORT_ACTIONS[arg]
+    return None
+
+#
+# Return the action flag of the parsed arguments, or None if there isn't one
+#
+def get_action(args):
+    for flag in ACTIONS:
+        if getattr(args, flag[2:].replace("-", "_")):
+            return flag
+    return None
+
+def create_parser(argv):
+    action = find_action(argv)
+    flags = [action] if action else list(ACTIONS)
+
+    options = set(COMMON_OPTIONS)
+    help = {}
+    if any(arg == "-h" or len(arg) > 3 and "--help".startswith(arg)
+        for arg in argv):
+        help = get_help()
+    parser = argparse.ArgumentParser()
+    for flag, (short, action_options) in ACTIONS.items():
+        if flag in flags:
+            options.update(action_options)
+        parser.add_argument(flag, short, action="store_true",
+            help=help.get(flag) if flag in flags else argparse.SUPPRESS)
+    for dest, (names, kwargs) in OPTIONS.items():
+        parser.add_argument(*names, help=help.get(dest) if dest in options
+            else argparse.SUPPRESS, **kwargs)
+    return parser
+
+#
+# Run the actions
+# - every handler takes the same arguments, and picks the ones its action
+#   needs
+#
+def run_hana_backup(args, cvs, auth, project_number, system_id,
+    userstore_key, cloud_volumes, network):
+    cvs.hana_backup(cloud_volumes, args.backup_name, system_id, userstore_key,
+        auth, project_number, args.verbose)
+
+def run_create_snapshot(args, cvs, auth, project_number, system_id,
+    userstore_key, cloud_volumes, network):
+    cvs.create_snapshot(cloud_volumes, args.snapshot_name, system_id, auth,
+        project_number, args.verbose)
+
+def run_open_backup(args, cvs, auth, project_number, system_id,
+    userstore_key, cloud_volumes, network):
+    open_backup(args.EBID, system_id, userstore_key, args.verbose)
+
+def run_close_backup(args, cvs, auth, project_number, system_id,
+    userstore_key, cloud_volumes, network):
+    close_backup(args.EBID, system_id, userstore_key, args.verbose)
+
+def run_restore(args, cvs, auth, project_number, system_id, userstore_key,
+    cloud_volumes, network):
+    cvs.restore(args.cloud_volume, args.snapshot, system_id, userstore_key,
+        auth, project_number, args.verbose)
+
+def run_clone(args, cvs, auth, project_number, system_id, userstore_key,
+    cloud_volumes, network):
+    cvs.clone(args.cloud_volume, args.snapshot, args.volume_name,
+        args.export_path, args.CIDR, auth, project_number, network,
+        args.verbose)
+
+def run_list_snapshots(args, cvs, auth, project_number, system_id,
+    userstore_key, cloud_volumes, network):
+    cvs.list_snapshots(args.cloud_volume, system_id, auth, project_number,
+        args.verbose, 0 if args.no_cache else args.cache_ttl)
+
+def run_delete_snapshot(args, cvs, auth, project_number, system_id,
+    userstore_key, cloud_volumes, network):
+    cvs.delete_snapshot(args.cloud_volume, args.snapshot, args.all_previous,
+        system_id, auth, project_number, args.verbose, args.max_parallel)
+
+# the handler of each action flag, the action is known once the arguments
+# are parsed, so its handler is called directly
+HANDLERS = {
+    "--hana-backup": run_hana_backup,
+    "--create-snapshot": run_create_snapshot,
+    "--open-backup": run_open_backup,
+    "--close-backup": run_close_backup,
+    "--restore": run_restore,
+    "--clone": run_clone,
+    "--list-snapshots": run_list_snapshots,
+    "--delete-snapshot": run_delete_snapshot,
+}
 
 if __name__ == "__main__":
+    args = create_parser(sys.argv[1:]).parse_args()
+    action = get_action(args)
+    if not action:
+        print("Error: specify --hana-backup, --create-snapshot, " + \
+            "--open-backup, --close-backup, --restore, --clone, " + \
+            "--list-snapshots, or --delete-snapshot")
+        sys.exit(2)
+    if args.max_parallel < 1:
+        print("Error - MAX_PARALLEL must be at least 1")
+        sys.exit(2)
+
     # create platform-specific object
+    import_libraries()
     CVS = CVS4GC()
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--hana-backup", "-b", action="store_true",
-        help="Usage: ntaphana --hana-backup \
-        [--cloud-volumes CLOUD_VOLUMES] [--backup-name BACKUP_NAME] \
-        [--SID SID] [--userstore-key USERSTORE_KEY] \
-        [--key-file KEY_FILE] [--config-file CONFIG_FILE] [--verbose] \
-        create a consistent backup of a HANA database and a backing snapshot \
-        of the cloud volume or volumes")
-    parser.add_argument("--create-snapshot", "-s", action="store_true",
-        help="Usage: ntaphana --create-snapshot \
-        [--cloud-volumes CLOUD_VOLUMES] [--snapshot-name SNAPSHOT_NAME] \
-        [--SID SID] [--key-file KEY_FILE] \
-        [--config-file CONFIG_FILE] [--verbose] \
-        create a snapshot of the cloud volume or volumes")
-    parser.add_argument("--open-backup", "-o", action="store_true",
-        help="Usage: ntaphana --open-backup [--EBID EBID] \
-        [--SID SID] [--userstore-key USERSTORE_KEY] \
-        [--config-file CONFIG_FILE] [--verbose] start a backup of HANA and \
-        set the EBID as the comment")
-    parser.add_argument("--close-backup", "-e", action="store_true",
-        help="Usage: ntaphana --close-backup [--EBID EBID] \
-        [--SID SID] [--userstore-key USERSTORE_KEY] \
-        [--config-file CONFIG_FILE] [--verbose] close a backup of HANA and \
-        set the EBID as the comment")
-    parser.add_argument("--restore", "-r", action="store_true",
-        help="Usage: ntaphana --restore --cloud-volume CLOUD_VOLUME \
-        --snapshot SNAPSHOT [--SID SID] [--userstore-key USERSTORE_KEY] \
-        [--key-file KEY_FILE] [--config-file CONFIG_FILE] [--verbose] \
-        restore data by copying from a snapshot into the active filesystem; \
-        database must be stopped first and this command must be run on the \
-        host where the database is running")
-    parser.add_argument("--clone", "-l", action="store_true",
-        help="Usage: ntaphana --clone --cloud-volume CLOUD_VOLUME \
-        --snapshot SNAPSHOT --volume-name VOLUME_NAME \
-        [--export-path EXPORT_PATH] [--CIDR CIDR] [--SID SID] \
-        [--key-file KEY_FILE] [--config-file CONFIG_FILE] [--verbose] \
-        create a volume from a snapshot; specify the volume and \
-        snapshot to be cloned and the name of the new volume")
-    parser.add_argument("--list-snapshots", "-L", action="store_true",
-        help="Usage: ntaphana --list-snapshots --cloud-volume CLOUD_VOLUME \
-        [--SID SID] [--key-file KEY_FILE] [--config-file CONFIG_FILE] \
-        [--verbose] \
-        list the snapshots of a cloud volume")
-    parser.add_argument("--delete-snapshot", "-x", action="store_true",
-        help="Usage: ntaphana --delete-snapshot --cloud-volume CLOUD_VOLUME \
-        --snapshot SNAPSHOT --all-previous [--SID SID] [--key-file KEY_FILE] \
-        [--config-file CONFIG_FILE] [--verbose] \
-        permanently delete a snapshot of a cloud volume; use the \
-        'all-previous' flag with caution")
-    parser.add_argument("--cloud-volumes", "-c", help="the name of a mount \
-        point or a cloud volume or a comma-separated list")
-    parser.add_argument("--backup-name", "-p", help="both the \
-        external backup id and the name of the snapshot")
-    parser.add_argument("--SID", "-i", help="the System ID of a HANA database")
-    parser.add_argument("--userstore-key", "-y", help="a userstore key with \
-        the permissions required to administer HANA")
-    parser.add_argument("--key-file", "-k", help="the name of a file \
-        containing credentials appropriate to the cloud provider; a path may \
-        be specified; by default, a file named \"key.json\" in the local \
-        directory will be used")
-    parser.add_argument("--config-file", "-f", help="the name of a file \
-        which may contain a project number, SID, hdbuserstore key, list \
-        of cloud volumes or virtual private cloud; by default, the local \
-        directory will be searched for a file named \"SID_config.json\" \
-        or \"config.json\", where SID is the System ID of the HANA database")
-    parser.add_argument("--verbose", "-v", action="store_true",
-        help="show execution details")
-    parser.add_argument("--snapshot-name", "-n", help="name of the snapshot")
-    parser.add_argument("--EBID", "-d", help="external backup id")
-    parser.add_argument("--cloud-volume", "-g", help="the name of a mount \
-        point or a cloud volume")
-    parser.add_argument("--snapshot", "-j", help="the name of a snapshot")
-    parser.add_argument("--volume-name", "-u", help="name of the volume to \
-        create")
-    parser.add_argument("--export-path", "-a", help="export path of the clone; \
-        if not specified, the name of the new volume will be used as the \
-        export path")
-    parser.add_argument("--CIDR", "-z", help="CIDR format describing hosts to \
-        export to with full permission; if not specified 0.0.0.0/0 will be \
-        used")
-    parser.add_argument("--all-previous", "-P", action="store_true",
-        help="delete all previous snapshots as well as the specified snapshot; \
-        use with caution")
-    args = parser.parse_args()
-
     # load the authentication headers from the key file
     auth = CVS.get_auth(args.key_file, args.verbose)
     # load the configuration from the config file
@@ -951,31 +1748,5 @@ if __name__ == "__main__":
         CVS.get_config(args.config_file, args.key_file, args.SID, 
         args.userstore_key, args.cloud_volumes, args.verbose)
 
-    if args.hana_backup:
-        CVS.hana_backup(cloud_volumes, args.backup_name, system_id, 
-            userstore_key, auth, project_number, args.verbose)
-    elif args.create_snapshot:
-        CVS.create_snapshot(cloud_volumes, args.snapshot_name, system_id, 
-            auth, project_number, args.verbose)
-    elif args.open_backup:
-        open_backup(args.EBID, system_id, userstore_key, args.verbose)
-    elif args.close_backup:
-        close_backup(args.EBID, system_id, userstore_key, args.verbose)
-    elif args.restore:
-        CVS.restore(args.cloud_volume, args.snapshot, system_id, userstore_key,
-            auth, project_number, args.verbose)
-    elif args.clone:
-        CVS.clone(args.cloud_volume, args.snapshot, args.volume_name,
-            args.export_path, args.CIDR, auth, project_number, network,
-            args.verbose)
-    elif args.list_snapshots:
-        CVS.list_snapshots(args.cloud_volume, system_id, auth, project_number, 
-            args.verbose)
-    elif args.delete_snapshot:
-        CVS.delete_snapshot(args.cloud_volume, args.snapshot, args.all_previous,
-            system_id, auth, project_number, args.verbose)
-    else:
-        print("Error: specify --hana-backup, --create-snapshot, " + \
-            "--open-backup, --close-backup, --restore, --clone, " + \
-            "--list-snapshots, or --delete-snapshot")
-
+    HANDLERS[action](args, CVS, auth, project_number, system_id,
+        userstore_key, cloud_volumes, network)